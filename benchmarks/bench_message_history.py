@@ -0,0 +1,92 @@
+"""
+Benchmark of building agent requests from a growing message history.
+
+Simulates a conversation in which every turn adds a question, a sql_exec tool use, its
+tool result with a query_df DataFrame and an answer. For every turn the request messages
+are built once with the previous approach (deepcopy of the whole history, then deleting the
+client-side query results and encoding everything) and once with AgentMessageHistory, which
+keeps an encoded API-ready form of each message.
+
+Usage:
+    python benchmarks/bench_message_history.py [--turns 200] [--rows 1000] [--repeat 3]
+"""
+import argparse
+import copy
+import json
+import time
+
+import pandas as pd
+
+from cortex_agent.message_formats import CLIENT_SIDE_RESULT_KEYS, AgentMessageHistory, Message, UserResult
+
+
+BODY = {
+    'model': 'claude-3-5-sonnet',
+    'tools': [{'tool_spec': {'type': 'sql_exec', 'name': 'sql_exec'}}],
+    'tool_resources': {},
+    'tool_choice': {'type': 'auto'},
+    'response_instruction': '',
+}
+
+
+def add_turn(history: AgentMessageHistory, turn: int, rows: int):
+    query_df = pd.DataFrame({'ID': range(rows), 'VALUE': [f'value {i}' for i in range(rows)]})
+    history.add(Message(role='user', content=f'Question {turn}: what is the total order quantity per region?'))
+    history.add(Message(role='assistant', content=[
+        {'type': 'text', 'text': 'Let me query the data. ' * 5},
+        {'type': 'tool_use', 'tool_use': {'tool_use_id': f'tool_{turn}', 'name': 'sql_exec', 'input': {'query': 'SELECT REGION, SUM(QUANTITY) FROM ORDERS GROUP BY REGION'}}},
+    ]))
+    history.add(Message(role='user', content=UserResult(query_id=f'query_{turn}', tool_name='sql_exec', tool_use_id=f'tool_{turn}', query_df=query_df)))
+    history.add(Message(role='assistant', content=f'The total order quantity for turn {turn} is 42. ' * 10))
+
+
+def build_with_deepcopy(history: AgentMessageHistory) -> bytes:
+    # the previous AgentMessageHistory.format_for_agent_call followed by httpx's json encoding
+    messages = copy.deepcopy(history.messages)
+    for message in messages:
+        if message['role'] == 'user':
+            if message['content'][0].get('tool_results'):
+                for key in CLIENT_SIDE_RESULT_KEYS:
+                    message['content'][0]['tool_results']['content'][0]['json'].pop(key, None)
+    return json.dumps({**BODY, 'messages': messages}).encode()
+
+
+def build_incremental(history: AgentMessageHistory) -> bytes:
+    return history.encode_request_body({**BODY, 'messages': history.format_for_agent_call()})
+
+
+def measure(build, history: AgentMessageHistory, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build(history)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{args.turns} turns, {args.rows} rows per query_df, best of {args.repeat} per turn")
+    print(f"{'turn':>6} {'deepcopy (ms)':>14} {'incremental (ms)':>17}")
+    history = AgentMessageHistory()
+    totals = {'deepcopy': 0.0, 'incremental': 0.0}
+    for turn in range(1, args.turns + 1):
+        add_turn(history, turn, args.rows)
+        assert json.loads(build_with_deepcopy(history)) == json.loads(build_incremental(history))
+        deepcopy_seconds = measure(build_with_deepcopy, history, args.repeat)
+        incremental_seconds = measure(build_incremental, history, args.repeat)
+        totals['deepcopy'] += deepcopy_seconds
+        totals['incremental'] += incremental_seconds
+        if turn == 1 or turn % max(args.turns // 8, 1) == 0:
+            print(f"{turn:>6} {deepcopy_seconds * 1000:>14.2f} {incremental_seconds * 1000:>17.2f}")
+    print(f"\nwhole conversation: deepcopy {totals['deepcopy']:.2f} s, incremental {totals['incremental']:.2f} s "
+          f"({totals['deepcopy'] / totals['incremental']:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Micro-benchmark of the SSE decoders for agent response streams.
+
+Compares httpx_sse's EventSource.aiter_sse with the built-in byte-level decoder
+(cortex_agent.sse.aiter_sse_bytes) on a synthetic stream of message.delta events, and on a
+stream with a single large message.delta event, e.g. Cortex Search results with full documents.
+
+Usage:
+    python benchmarks/bench_sse_parser.py [--events 20000] [--large-event-mb 8] [--chunk-size 4096] [--repeat 5]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from httpx_sse import EventSource
+from httpx_sse._decoders import SSEDecoder, SSELineDecoder
+
+from cortex_agent.sse import SSEByteDecoder, aiter_sse_bytes
+
+
+def build_stream(number_of_events: int) -> bytes:
+    frames = []
+    for i in range(number_of_events):
+        data = {
+            'id': 'msg_001',
+            'object': 'message.delta',
+            'delta': {'content': [{'index': 0, 'type': 'text', 'text': f'token {i} '}]}
+        }
+        frames.append(f"event: message.delta\ndata: {json.dumps(data)}\n\n")
+    frames.append("event: done\ndata: [DONE]\n\n")
+    return ''.join(frames).encode('utf-8')
+
+
+def build_large_event_stream(megabytes: float) -> bytes:
+    document = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 30
+    number_of_documents = max(int(megabytes * 1e6 / len(document)), 1)
+    data = {
+        'id': 'msg_001',
+        'object': 'message.delta',
+        'delta': {'content': [{'type': 'tool_results', 'tool_results': {'content': [{'type': 'json', 'json': {
+            'searchResults': [{'doc_id': i, 'text': document} for i in range(number_of_documents)]
+        }}]}}]}
+    }
+    return f"event: message.delta\ndata: {json.dumps(data)}\n\nevent: done\ndata: [DONE]\n\n".encode('utf-8')
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    def __init__(self, payload: bytes, chunk_size: int):
+        self.payload = payload
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self):
+        for start in range(0, len(self.payload), self.chunk_size):
+            yield self.payload[start:start + self.chunk_size]
+
+
+def make_response(payload: bytes, chunk_size: int) -> httpx.Response:
+    return httpx.Response(200, headers={'content-type': 'text/event-stream'}, stream=ChunkedStream(payload, chunk_size))
+
+
+async def count_httpx_sse(payload: bytes, chunk_size: int) -> int:
+    count = 0
+    async for _ in EventSource(make_response(payload, chunk_size)).aiter_sse():
+        count += 1
+    return count
+
+
+async def count_builtin(payload: bytes, chunk_size: int) -> int:
+    count = 0
+    async for _ in aiter_sse_bytes(make_response(payload, chunk_size)):
+        count += 1
+    return count
+
+
+def decode_httpx_sse(chunks) -> int:
+    # the parsing steps of EventSource.aiter_sse without the HTTP response
+    line_decoder = SSELineDecoder()
+    decoder = SSEDecoder()
+    count = 0
+    for chunk in chunks:
+        for line in line_decoder.decode(chunk.decode('utf-8')):
+            if decoder.decode(line.rstrip('\n')) is not None:
+                count += 1
+    return count
+
+
+def decode_builtin(chunks) -> int:
+    decoder = SSEByteDecoder()
+    count = 0
+    for chunk in chunks:
+        count += len(decoder.feed(chunk))
+    return count + len(decoder.flush())
+
+
+def measure_decoder_only(decoder, payload: bytes, chunk_size: int, repeat: int):
+    chunks = [payload[start:start + chunk_size] for start in range(0, len(payload), chunk_size)]
+    best = float('inf')
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = decoder(chunks)
+        best = min(best, time.perf_counter() - start)
+    return count, best
+
+
+def measure(decoder, payload: bytes, chunk_size: int, repeat: int):
+    best = float('inf')
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = asyncio.run(decoder(payload, chunk_size))
+        best = min(best, time.perf_counter() - start)
+    return count, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--large-event-mb', type=float, default=8)
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payload = build_stream(args.events)
+    large_event_payload = build_large_event_stream(args.large_event_mb)
+    print(f"{args.events} events, {len(payload) / 1e6:.1f} MB, {args.chunk_size} byte chunks, best of {args.repeat}")
+    benchmarks = [
+        ('streamed response', measure, payload, [('httpx_sse', count_httpx_sse), ('builtin', count_builtin)]),
+        ('decoder only', measure_decoder_only, payload, [('httpx_sse', decode_httpx_sse), ('builtin', decode_builtin)]),
+        (f'single {len(large_event_payload) / 1e6:.1f} MB event, decoder only', measure_decoder_only, large_event_payload, [('httpx_sse', decode_httpx_sse), ('builtin', decode_builtin)]),
+    ]
+    for title, measure_function, payload, decoders in benchmarks:
+        print(f"\n{title}:")
+        results = {}
+        for name, decoder in decoders:
+            count, seconds = measure_function(decoder, payload, args.chunk_size, args.repeat)
+            results[name] = seconds
+            print(f"{name:>10}: {count} events in {seconds * 1000:8.1f} ms ({count / seconds:,.0f} events/s)")
+        print(f"   speedup: {results['httpx_sse'] / results['builtin']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -41,7 +41,7 @@ else:
     with st.sidebar:
         if st.button('Reset Agent Chat', use_container_width=True):
             agent.api_handler.message_history = AgentMessageHistory()
-            agent.api_handler.api_history = AgentAPIHistory()
+            agent.api_handler.api_history.clear()
 
 
     streamlit_message_handler = StreamlitMessageHandler(agent)
@@ -1,5 +1,4 @@
 import streamlit as st
-import json
 from cortex_agent.message_formats import AgentAPIRequest, AgentAPIResponse
 from cortex_agent.callbacks import StreamlitMessageHandler
 import time
@@ -33,7 +32,7 @@ with st.sidebar:
                     if api_call.event.event == "message.delta":
                         with st.expander(f"ResponseHeader_{i}", expanded=False):
                             st.write(dict(api_call.header))
-                        data = json.loads(api_call.event.data)
+                        data = api_call.event.json()
                         st.write(data)
                     if api_call.event.event == "done":
                         with st.expander(f"ResponseHeader_{i}", expanded=False):
@@ -38,17 +38,7 @@ def setup_module_logger(level="INFO"):
 setup_module_logger(level='DEBUG')
 logger = logging.getLogger("cortex_agent")
 
-    
-if is_running_in_notebook():
-    import nest_asyncio
-    nest_asyncio.apply()
-    logger.info('Found interactive environment (such as a notebook). Applied nest_asyncio to correctly support async calls.')
-
-if is_running_in_snowflake_notebook():
-    import nest_asyncio
-    nest_asyncio.apply()
-    logger.info('Found Snowflake Notebook environment. Applied nest_asyncio to correctly support async calls.')
-    
+
 __all__ = [
     "CortexAgent",
     "CortexAgentTool",
@@ -1,14 +1,22 @@
 from dataclasses import dataclass, field
-from typing import Optional
-from .connection import CortexAgentConnection
+from typing import Callable, Optional
+from .connection import CortexAgentConnection, RequestTimeouts
+from .retry import RetryPolicy
+from .rate_limiter import RateLimit
+from .result_store import RESULT_STORE_MAX_BYTES
+from .sql_execution import SQLExecutionPolicy
+from .session_pool import SessionPoolPolicy
+from .sql_cache import SQLResultCache
 from .configuration import CortexAgentConfiguration
-from .api_handler import CortexAgentAPIHandler, CortexLLMAPIHandler
+from .api_handler import CortexAgentAPIHandler, CortexLLMAPIHandler, iterate_in_background_loop
 from snowflake.snowpark import Session
+import httpx
 import logging
-import json
 from httpx_sse._models import ServerSentEvent
 from .callbacks import ConversationalCallback
-from .message_formats import Message
+from .message_formats import Message, AgentRunResult, TurnStep
+import asyncio
+from contextlib import aclosing
 logger = logging.getLogger("cortex_agent.agent")
     
 @dataclass
@@ -26,12 +34,32 @@ class CortexAgent:
         private_key_file (Optional[str]): Path to the private key file for JWT authentication.
         programmatic_access_token (Optional[str]): Token for programmatic access.
         connection_parameters (Optional[dict]): Additional connection parameters.
+        http_limits (Optional[httpx.Limits]): Pool limits and keep-alive settings for the shared HTTP client.
+        retry_policy (Optional[RetryPolicy]): Retry behavior for failed calls to the agent and complete endpoints.
+        agent_rate_limit (Optional[RateLimit]): Client-side rate limit for the agent endpoint of the account.
+        complete_rate_limit (Optional[RateLimit]): Client-side rate limit for the complete endpoint of the account.
+        timeouts (Optional[RequestTimeouts]): Connect, first-byte, idle and turn timeouts for API calls.
+        sse_decoder (str): Decoder for response streams, either 'httpx_sse' or the faster 'builtin' byte-level decoder.
+        sql_execution (Optional[SQLExecutionPolicy]): Polling, timeout and cancellation of client-side SQL executions.
+        sql_result_cache (Optional[SQLResultCache]): Cache for the results of client-side SQL executions (None disables caching).
+        result_store_max_bytes (int): Memory budget for the results of client-side SQL executions; evicted results are fetched again with RESULT_SCAN.
+        session_pool_policy (Optional[SessionPoolPolicy]): Pool of sessions so that concurrent conversations run their SQL in parallel (None runs all SQL through one session).
     """
     configuration:  Optional[CortexAgentConfiguration] =  field(default_factory=CortexAgentConfiguration)
     session: Optional[Session] = None
     private_key_file: Optional[str] = None
     programmatic_access_token: Optional[str] = None
     connection_parameters: Optional[dict] = None
+    http_limits: Optional[httpx.Limits] = None
+    retry_policy: Optional[RetryPolicy] = None
+    agent_rate_limit: Optional[RateLimit] = None
+    complete_rate_limit: Optional[RateLimit] = None
+    timeouts: Optional[RequestTimeouts] = None
+    sse_decoder: str = 'httpx_sse'
+    sql_execution: Optional[SQLExecutionPolicy] = None
+    sql_result_cache: Optional[SQLResultCache] = None
+    result_store_max_bytes: int = RESULT_STORE_MAX_BYTES
+    session_pool_policy: Optional[SessionPoolPolicy] = None
     #logger: logging.Logger = field(default_factory=lambda: logging.getLogger(__name__))
 
     def __post_init__(self):
@@ -40,7 +68,17 @@ class CortexAgent:
             session=self.session, 
             private_key_file=self.private_key_file, 
             programmatic_access_token=self.programmatic_access_token,
-            connection_parameters=self.connection_parameters
+            connection_parameters=self.connection_parameters,
+            http_limits=self.http_limits,
+            retry_policy=self.retry_policy,
+            agent_rate_limit=self.agent_rate_limit,
+            complete_rate_limit=self.complete_rate_limit,
+            timeouts=self.timeouts,
+            sse_decoder=self.sse_decoder,
+            sql_execution=self.sql_execution,
+            sql_result_cache=self.sql_result_cache,
+            result_store_max_bytes=self.result_store_max_bytes,
+            session_pool_policy=self.session_pool_policy
             )
         
         self.api_handler = CortexAgentAPIHandler(
@@ -52,20 +90,21 @@ class CortexAgent:
             configuration=self.configuration
             )
         
-    def make_request(self, content:str, callback=None):
+    def make_request(self, content:str, callback=None, should_continue: Optional[Callable[[TurnStep], bool]] = None):
         """
         Makes a request to the Cortex Agent and optionally uses a callback to process the response.
 
         Args:
             content (str): The prompt or user message.
             callback (callable): Optional function to handle response streaming.
+            should_continue (Optional[Callable[[TurnStep], bool]]): Called after every step that executed SQL; returning False ends the turn early.
 
         Yields:
             The agent's response, processed through the callback if provided.
         """
         _callback = callback if callback else ConversationalCallback(self)
 
-        for event in self.api_handler.make_request(content=content):
+        for event in self.api_handler.make_request(content=content, should_continue=should_continue):
             event = _callback(event)
             if hasattr(event, '__iter__') and not isinstance(event, Message):
                 for part in event:
@@ -73,6 +112,121 @@ class CortexAgent:
             else:
                 yield event
 
+    async def amake_request(self, content:str, callback=None, should_continue: Optional[Callable[[TurnStep], bool]] = None):
+        """
+        Asynchronously makes a request to the Cortex Agent and optionally uses a callback to process the response.
+
+        Events are streamed straight from the API, which allows many conversations
+        to be served concurrently from a single event loop.
+
+        Args:
+            content (str): The prompt or user message.
+            callback (callable): Optional function to handle response streaming.
+            should_continue (Optional[Callable[[TurnStep], bool]]): Called after every step that executed SQL; returning False ends the turn early.
+
+        Yields:
+            The agent's response, processed through the callback if provided.
+        """
+        _callback = callback if callback else ConversationalCallback(self)
+
+        async with aclosing(self.api_handler.amake_request(content=content, should_continue=should_continue)) as events:
+            async for event in events:
+                event = _callback(event)
+                if hasattr(event, '__iter__') and not isinstance(event, Message):
+                    for part in event:
+                        yield part
+                else:
+                    yield event
+
+    def run_many(self, prompts, concurrency: int = 8, ordered: bool = True):
+        """
+        Sends many independent prompts to the Cortex Agent with bounded concurrency.
+
+        Each prompt gets its own message history, so prompts do not see each other's
+        conversation. Requests share the agent's connection and configuration.
+
+        Args:
+            prompts (Iterable[str]): The prompts to send.
+            concurrency (int): Maximum number of prompts processed at the same time.
+            ordered (bool): Yield results in input order if True, otherwise as they complete.
+
+        Yields:
+            AgentRunResult: The result of each prompt.
+        """
+        return iterate_in_background_loop(self.arun_many(prompts, concurrency=concurrency, ordered=ordered))
+
+    async def arun_many(self, prompts, concurrency: int = 8, ordered: bool = True):
+        """
+        Asynchronously sends many independent prompts to the Cortex Agent with bounded concurrency.
+
+        Args:
+            prompts (Iterable[str]): The prompts to send.
+            concurrency (int): Maximum number of prompts processed at the same time.
+            ordered (bool): Yield results in input order if True, otherwise as they complete.
+
+        Yields:
+            AgentRunResult: The result of each prompt.
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1.")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(index, prompt):
+            async with semaphore:
+                api_handler = CortexAgentAPIHandler(connection=self.connection, configuration=self.configuration)
+                error = None
+                try:
+                    async with aclosing(api_handler.amake_request(content=prompt)) as events:
+                        async for _ in events:
+                            pass
+                except Exception as e:
+                    logger.error(f"Error while processing prompt {index}: {e}")
+                    error = e
+                return AgentRunResult(
+                    index=index,
+                    prompt=prompt,
+                    text=_last_assistant_text(api_handler.message_history),
+                    message_history=api_handler.message_history,
+                    api_history=api_handler.api_history,
+                    error=error
+                )
+
+        tasks = [asyncio.create_task(run(index, prompt)) for index, prompt in enumerate(prompts)]
+        try:
+            if ordered:
+                for task in tasks:
+                    yield await task
+            else:
+                for next_result in asyncio.as_completed(tasks):
+                    yield await next_result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def close(self):
+        """
+        Closes the pooled HTTP connections used by this agent.
+        """
+        self.connection.close()
+
+    async def aclose(self):
+        """
+        Closes the pooled HTTP connections used by this agent from within an event loop.
+        """
+        await self.connection.aclose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
     def save_to_table(self, table: str, agent_name: str, database:str = None, schema: str = None, overwrite: bool = False, agent_description: str = ''):
         """
         Saves an agent's configuration to a Snowflake table
@@ -125,13 +279,7 @@ class CortexAgent:
             The agent's response, processed through the callback if provided.
         """
 
-        def default_callback(item):
-            if isinstance(item, Message):
-                return ''
-            if isinstance(item, ServerSentEvent):
-                item = json.loads(item.data)['choices'][0]['delta'].get('content','')
-                return item
-        _callback = callback if callback else default_callback
+        _callback = callback if callback else _default_complete_callback
 
         for event in self.llm_api_handler.make_request(content=content):
             event = _callback(event)
@@ -139,4 +287,40 @@ class CortexAgent:
                 for part in event:
                     yield part
             else:
-                yield event
\ No newline at end of file
+                yield event
+
+    async def acomplete(self, content:str, callback=None):
+        """
+        Asynchronously makes a request to Cortex Complete and optionally uses a callback to process the response.
+
+        Args:
+            content (str): The prompt or user message.
+            callback (callable): Optional function to handle response streaming.
+
+        Yields:
+            The LLM's response, processed through the callback if provided.
+        """
+        _callback = callback if callback else _default_complete_callback
+
+        async with aclosing(self.llm_api_handler.amake_request(content=content)) as events:
+            async for event in events:
+                event = _callback(event)
+                if hasattr(event, '__iter__') and not isinstance(event, Message) and not isinstance(event, str):
+                    for part in event:
+                        yield part
+                else:
+                    yield event
+
+
+def _default_complete_callback(item):
+    if isinstance(item, Message):
+        return ''
+    if isinstance(item, ServerSentEvent):
+        item = item.json()['choices'][0]['delta'].get('content','')
+        return item
+
+def _last_assistant_text(message_history):
+    for message in reversed(message_history.messages):
+        if message['role'] == 'assistant':
+            return ''.join(content['text'] for content in message['content'] if content.get('type') == 'text')
+    return ''
@@ -1,21 +1,327 @@
 import copy
-from typing import List, Any, Dict, Union
+from typing import List, Any, Callable, Dict, Union
 from dataclasses import dataclass
 from .connection import CortexAgentConnection
 from .configuration import CortexAgentConfiguration
-from .message_formats import Message, UserResult, AgentAPIHistory, AgentMessageHistory, format_events_for_message_history, format_events_for_llm_message_history
+from .message_formats import Message, UserResult, UserToolError, QueryResultBatch, TurnStep, AgentAPIHistory, AgentMessageHistory, AssistantMessageBuilder, LLMMessageBuilder
 from httpx_sse._models import ServerSentEvent
-from httpx import AsyncClient
 from httpx_sse import aconnect_sse
+from .sse import ParsedServerSentEvent, aiter_sse_bytes
+from .exceptions import CortexAgentAPIError, CortexAgentConnectTimeoutError, CortexAgentFirstByteTimeoutError, CortexAgentIdleTimeoutError, CortexAgentDeadlineExceededError, CortexAgentTimeoutError
+from .sql_execution import aiter_result_batches, asubmit_sql, await_query, compact_dtypes
+from .sql_cache import is_cacheable
+from snowflake.snowpark import Session
+import httpx
 import asyncio
-from typing import Generator
+from typing import Generator, AsyncGenerator, Optional, Tuple
 import json
 import pandas as pd
 import logging
 from queue import SimpleQueue
+import concurrent.futures
 import threading
+import os
+from contextlib import aclosing
 logger = logging.getLogger("cortex_agent.api_handler")
 
+
+class _BackgroundEventLoop:
+    """
+    A single event loop running in a daemon thread that drives all synchronous requests of the process.
+
+    Synchronous callers hand their async generators to this loop and only block on a
+    thread-safe queue, so several threads can stream from different agents at the same time
+    and no event loop is ever nested or re-entered.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name='cortex-agent-event-loop', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @classmethod
+    def get(cls):
+        with cls._lock:
+            instance = cls._instance
+            # a forked child process does not inherit the loop thread
+            if instance is None or instance.pid != os.getpid() or not instance.thread.is_alive():
+                instance = cls._instance = cls()
+            return instance
+
+
+class _StreamError:
+    """Carries an exception raised on the background loop over to the consuming thread."""
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+_END_OF_STREAM = object()
+
+
+def iterate_in_background_loop(async_iterator) -> Generator:
+    """
+    Iterates an async iterator on the background event loop and yields its items synchronously.
+
+    Args:
+        async_iterator (AsyncIterator): The async iterator to drive, e.g. an async generator.
+
+    The async iterator only advances when the caller asks for the next item, so a slow or
+    abandoned consumer never lets the request run ahead, e.g. into client-side SQL execution.
+
+    Yields:
+        The items produced by the async iterator. Exceptions are re-raised in the calling thread.
+    """
+    background = _BackgroundEventLoop.get()
+    if threading.current_thread() is background.thread:
+        raise RuntimeError("Synchronous requests can not be made from the background event loop. Use the async interface instead.")
+    queue = SimpleQueue()
+    # set by the consumer when it asks for the next item or stops iterating
+    requested = asyncio.Event()
+    stopped = False
+    at_yield = False
+
+    async def pump():
+        try:
+            async with aclosing(async_iterator):
+                async for item in async_iterator:
+                    queue.put(item)
+                    await requested.wait()
+                    requested.clear()
+                    if stopped:
+                        break
+        except Exception as e:
+            logger.error(f"Error during async request: {e}")
+            queue.put(_StreamError(e))
+        finally:
+            queue.put(_END_OF_STREAM)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), background.loop)
+    try:
+        while True:
+            item = queue.get()
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, _StreamError):
+                raise item.exception
+            at_yield = True
+            yield item
+            at_yield = False
+            background.loop.call_soon_threadsafe(requested.set)
+    finally:
+        # the consumer stopped iterating: close the request, which closes the HTTP stream
+        # and skips any follow-up work such as client-side SQL execution
+        if not future.done():
+            if at_yield:
+                stopped = True
+                background.loop.call_soon_threadsafe(requested.set)
+                # the next request must see the message history the closed request left behind
+                if threading.current_thread() is not background.thread:
+                    concurrent.futures.wait([future])
+            else:
+                future.cancel()
+
+
+def _api_error_from_response(response: httpx.Response, error_text: str) -> CortexAgentAPIError:
+    """Builds a typed error from a non-200 response of the Cortex REST APIs."""
+    try:
+        error = json.loads(error_text)
+    except ValueError:
+        error = {}
+    if not isinstance(error, dict):
+        error = {}
+    return CortexAgentAPIError(
+        error_code=error.get('code'),
+        message=error.get('message', error_text),
+        request_id=error.get('request_id'),
+        status_code=response.status_code
+    )
+
+
+async def _stream_events(connection: CortexAgentConnection, endpoint: str, headers: dict, body: dict, api_history: AgentAPIHistory, deadline: Optional[float] = None, content: Optional[bytes] = None, context_tokens: Optional[int] = None) -> AsyncGenerator:
+    """
+    Posts a request to a Cortex REST API endpoint and yields the Server-Sent Events of the response.
+
+    Every attempt waits for the connection's client-side rate limit. Transient failures are
+    retried according to the connection's retry policy, but only as long as no event has
+    been yielded to the caller yet. The first-byte and idle timeouts of the connection
+    and the optional turn deadline (in event loop time) raise typed timeout errors.
+    If given, the pre-encoded content is sent instead of encoding the body again.
+    """
+    request_entry = api_history.add(header=headers, event=body)
+    request_entry.context_tokens = context_tokens
+    try:
+        url = f'https://{connection.account_url}{endpoint}'
+        retry_policy = connection.retry_policy
+        timeouts = connection.timeouts
+        client = connection.get_http_client()
+        payload = {'json': body} if content is None else {'content': content}
+        loop = asyncio.get_running_loop()
+
+        def expires_at(timeout):
+            # the earlier of a phase timeout and the turn deadline
+            when = None if timeout is None else loop.time() + timeout
+            if deadline is not None and (when is None or deadline < when):
+                when = deadline
+            return when
+
+        attempt = 0
+        while True:
+            events_yielded = False
+            try:
+                async with asyncio.timeout_at(deadline):
+                    request_entry.rate_limit_wait += await connection.acquire_rate_limit(endpoint)
+                async with asyncio.timeout_at(expires_at(timeouts.first_byte)) as timer:
+                    async with aconnect_sse(client, method="POST", url=url, **payload, headers=headers, timeout=timeouts.to_httpx_timeout()) as event_source:
+                        response = event_source.response
+                        if response.status_code == 200:
+                            response_header = api_history.add_response_header(request_entry, response.headers)
+                            if connection.sse_decoder == 'builtin':
+                                events = aiter_sse_bytes(response)
+                            else:
+                                events = event_source.aiter_sse()
+                            async for event in events:
+                                event = ParsedServerSentEvent.from_event(event)
+                                events_yielded = True
+                                # time spent by the consumer does not count towards the idle timeout
+                                timer.reschedule(None)
+                                yield event # yielding SSE
+                                request_entry.event_count += 1
+                                api_history.add(header=response_header, event=event, request=request_entry)
+                                timer.reschedule(expires_at(timeouts.idle))
+                            return
+                        error_text = (await response.aread()).decode()
+                        error = _api_error_from_response(response, error_text)
+                        if attempt >= retry_policy.max_retries or not retry_policy.is_retryable(response.status_code):
+                            raise error
+                        delay = retry_policy.get_delay(attempt, response.headers.get('Retry-After'))
+                        reason = f"status code {response.status_code}"
+            except TimeoutError:
+                if deadline is not None and loop.time() >= deadline:
+                    raise CortexAgentDeadlineExceededError(f"Turn exceeded its deadline of {timeouts.turn}s.", timeouts.turn) from None
+                if events_yielded:
+                    raise CortexAgentIdleTimeoutError(f"No event received from {url} within {timeouts.idle}s.", timeouts.idle) from None
+                if attempt >= retry_policy.max_retries:
+                    raise CortexAgentFirstByteTimeoutError(f"No response received from {url} within {timeouts.first_byte}s.", timeouts.first_byte) from None
+                delay = retry_policy.get_delay(attempt)
+                reason = f"no response within {timeouts.first_byte}s"
+            except httpx.TransportError as e:
+                if events_yielded or attempt >= retry_policy.max_retries:
+                    if isinstance(e, (httpx.ConnectTimeout, httpx.PoolTimeout, httpx.WriteTimeout)):
+                        raise CortexAgentConnectTimeoutError(f"Could not connect to {url} within {timeouts.connect}s.", timeouts.connect) from e
+                    raise
+                delay = retry_policy.get_delay(attempt)
+                reason = f"{e.__class__.__name__}: {e}"
+            if deadline is not None and loop.time() + delay >= deadline:
+                raise CortexAgentDeadlineExceededError(f"Turn exceeded its deadline of {timeouts.turn}s.", timeouts.turn)
+            attempt += 1
+            request_entry.retries = attempt
+            request_entry.retry_wait += delay
+            logger.warning(f"Request to {url} failed with {reason}. Retry {attempt}/{retry_policy.max_retries} in {delay:.2f}s.")
+            await asyncio.sleep(delay)
+    finally:
+        api_history.finish_request(request_entry)
+
+
+class _TurnSession:
+    """
+    Checks out one session for all SQL executions of a turn, when the first execution starts.
+    """
+    def __init__(self, connection: CortexAgentConnection):
+        self._connection = connection
+        self._session = None
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> Session:
+        async with self._lock:
+            if self._session is None:
+                self._session = await self._connection.aacquire_session()
+            return self._session
+
+    def release(self):
+        """
+        Returns the session at the end of the turn.
+        """
+        if self._session is not None:
+            self._connection.release_session(self._session)
+            self._session = None
+
+
+class _SQLExecutionTasks:
+    """
+    Runs the SQL executions requested by the agent in one step of a turn as concurrent tasks.
+
+    Executions can be started while the response is still streaming. Their result batches
+    are buffered until results() is consumed. All executions run on the session of the turn.
+    """
+    def __init__(self, execute_sql: Callable[..., AsyncGenerator], turn_session: _TurnSession):
+        self._execute_sql = execute_sql
+        self._turn_session = turn_session
+        self._queue = asyncio.Queue()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._user_results: Dict[str, UserResult] = {}
+
+    def start(self, sql_execution: Tuple[str, str, str]):
+        """
+        Starts an execution unless it is already running.
+        """
+        tool_use_id = sql_execution[1]
+        if tool_use_id not in self._tasks:
+            self._tasks[tool_use_id] = asyncio.create_task(self._execute(sql_execution))
+
+    async def _execute(self, sql_execution: Tuple[str, str, str]):
+        try:
+            session = await self._turn_session.get()
+            async with aclosing(self._execute_sql(session, *sql_execution)) as results:
+                async for result in results:
+                    if isinstance(result, UserResult):
+                        self._user_results[sql_execution[1]] = result
+                    else:
+                        self._queue.put_nowait(result)
+        except Exception as e:
+            self._queue.put_nowait(e)
+        else:
+            self._queue.put_nowait(None)
+
+    async def results(self, sql_executions: List[Tuple[str, str, str]]) -> AsyncGenerator:
+        """
+        Starts the executions that are not running yet and waits for all of them.
+
+        Yields the QueryResultBatch objects of all statements as they are downloaded and finally
+        the list of UserResults in the order of the tool uses. If one statement fails, the others
+        are cancelled.
+        """
+        for sql_execution in sql_executions:
+            self.start(sql_execution)
+        try:
+            running = len(self._tasks)
+            while running:
+                item = await self._queue.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            await self.aclose()
+        yield [self._user_results[tool_use_id] for _, tool_use_id, _ in sql_executions]
+
+    async def aclose(self):
+        """
+        Cancels the executions that are still running.
+        """
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
 class CortexAgentAPIHandler:
     """
     Handles API interactions with the Cortex Agent.
@@ -29,12 +335,14 @@ class CortexAgentAPIHandler:
         configuration (CortexAgentConfiguration): The configuration containing model, tools, and instructions.
         api_history (AgentAPIHistory): History of API requests and responses.
         message_history (AgentMessageHistory): History of messages exchanged with the agent.
+        turn_steps (List[TurnStep]): Timings of the agent calls and SQL executions of the last turn.
     """
     def __init__(self, connection: CortexAgentConnection, configuration: CortexAgentConfiguration):
         self.connection = connection
         self.configuration = configuration
-        self.api_history = AgentAPIHistory()
+        self.api_history = AgentAPIHistory(level=configuration.api_history_level, max_entries=configuration.api_history_max_entries, store=configuration.api_history_store)
         self.message_history = AgentMessageHistory()
+        self.turn_steps: List[TurnStep] = []
 
     def _build_request(self):
         headers = {}
@@ -63,127 +371,291 @@ class CortexAgentAPIHandler:
         return resources
     
 
-    async def _make_async_request(self, headers:dict, body:dict):
-        self.api_history.add(header=headers, event=body)
-        all_events_from_response = []
+    async def _make_async_request(self, headers:dict, body:dict, deadline: Optional[float] = None, on_content: Optional[Callable[[dict], None]] = None):
+        message_builder = AssistantMessageBuilder()
         logger.debug(f"""
             Making request with the following data:
             URL: https://{self.connection.account_url}{self.connection.API_ENDPOINT}
             Header: {headers}
-            Body: {body}"""
+            Body: {({key: value for key, value in body.items() if key != 'messages'})} with {len(body['messages'])} messages"""
         )
-        async with AsyncClient(timeout=None) as client:
-            async with aconnect_sse(
-                client,
-                method="POST",
-                url=f'https://{self.connection.account_url}{self.connection.API_ENDPOINT}',
-                json=body,
-                headers=headers
-            ) as event_source:
-                if event_source.response.status_code == 200:
-                    async for event in event_source.aiter_sse():
-                        yield event # yielding SSE
-                        self.api_history.add(header=event_source.response.headers, event=event)
-                        all_events_from_response.append(event)
-                else:
-                    error_text = await event_source.response.aread()
-                    raise Exception(f"Agent got a bad API response: {event_source.response.status_code} - {error_text.decode()}")
-                events_for_message_history = format_events_for_message_history(all_events_from_response)
-                message = Message(role='assistant', content=events_for_message_history)
-                self.message_history.add(message)
+        content = self.message_history.encode_request_body(body)
+        context_tokens = self.message_history.context_tokens
+        async with aclosing(_stream_events(self.connection, self.connection.API_ENDPOINT, headers, body, self.api_history, deadline=deadline, content=content, context_tokens=context_tokens)) as events:
+            async for event in events:
+                content = message_builder.add(event)
+                if on_content is not None:
+                    for item in content:
+                        on_content(item)
+                yield event
+        message = Message(role='assistant', content=message_builder.build())
+        self.message_history.add(message)
+
+    async def _afit_context_window(self):
+        """Compacts tool payloads of older turns and removes or summarizes the oldest turns if the conversation exceeds the configured token budget."""
+        if self.configuration.compact_after_turns is not None:
+            self.message_history.compact(self.configuration.compact_after_turns)
+        token_budget = self.configuration.context_token_budget
+        if token_budget is None:
+            return
+        while True:
+            removed_messages = self.message_history.trim_to_budget(token_budget)
+            if not removed_messages or self.configuration.context_overflow != 'summarize':
+                return
+            summary = await self._asummarize(self.message_history.summary, removed_messages)
+            self.message_history.set_summary(summary)
 
-    def _check_if_sql_execution_requested(self):
-        sql_tool_name = None
-        sql_tool_use_id = None
-        sql_statement = None
+    async def _asummarize(self, previous_summary: Optional[str], messages: List[dict]) -> str:
+        """Summarizes messages removed from the context with the complete endpoint."""
+        lines = []
+        if previous_summary:
+            lines.append(f"Summary of the conversation so far: {previous_summary}")
+        for message in messages:
+            for item in message['content']:
+                if item.get('type') == 'text':
+                    lines.append(f"{message['role']}: {item['text']}")
+                elif item.get('type') == 'tool_use':
+                    lines.append(f"{message['role']} used tool {item['tool_use']['name']} with input {json.dumps(item['tool_use'].get('input'))}")
+        prompt = (
+            "Summarize the following conversation between a user and a data agent in a few sentences. "
+            "Keep facts, numbers, names and open questions that later questions might refer to.\n\n" + "\n".join(lines)
+        )
+        llm_api_handler = CortexLLMAPIHandler(connection=self.connection, configuration=self.configuration)
+        async with aclosing(llm_api_handler.amake_request(prompt)) as items:
+            async for _ in items:
+                pass
+        return llm_api_handler.message_history[-1]['content'][0]['text']
+
+    @staticmethod
+    def _get_sql_execution(content: dict, sql_exec_tool_names: List[str]) -> Optional[Tuple[str, str, str]]:
+        """
+        Returns tool name, tool use ID and statement if a message content item requests a SQL execution.
+        """
         try:
-            last_message = json.loads(self.api_history[-2].event.data)['delta']['content'][-1]
-            if last_message['type'] == 'tool_use':
-                if last_message['tool_use']['name'] in [tool.name for tool in self.configuration._get_sql_exec_tools()]:
-                    sql_tool_name = last_message['tool_use']['name']
-                    sql_tool_use_id = last_message['tool_use']['tool_use_id']
-                    sql_statement = last_message['tool_use']['input']['query'].replace('\n',' ')
-        except:
-            pass
-        return sql_tool_name, sql_tool_use_id, sql_statement
-    
-    def make_request(self, content, role:str = None) -> Generator:
+            if content['type'] == 'tool_use' and content['tool_use']['name'] in sql_exec_tool_names:
+                tool_use = content['tool_use']
+                return tool_use['name'], tool_use['tool_use_id'], tool_use['input']['query'].replace('\n',' ')
+        except (KeyError, TypeError, AttributeError):
+            logger.warning(f"Ignoring malformed tool use: {content}")
+        return None
+
+    def _check_if_sql_execution_requested(self) -> List[Tuple[str, str, str]]:
+        """
+        Returns tool name, tool use ID and statement of every SQL execution requested in the last assistant message.
+        """
+        try:
+            last_message = self.message_history[-1]
+        except IndexError:
+            return []
+        if last_message['role'] != 'assistant':
+            return []
+        sql_exec_tool_names = [tool.name for tool in self.configuration._get_sql_exec_tools()]
+        sql_executions = [self._get_sql_execution(content, sql_exec_tool_names) for content in last_message['content']]
+        return [sql_execution for sql_execution in sql_executions if sql_execution is not None]
+
+    async def _aexecute_sql(self, session: Session, sql_tool_name: str, sql_tool_use_id: str, sql_statement: str) -> AsyncGenerator:
+        """
+        Executes a SQL statement requested by the agent without blocking the event loop.
+
+        Yields a QueryResultBatch for every result batch as it is downloaded and finally the UserResult.
+        """
+        policy = self.connection.sql_execution
+        cache = self.connection.sql_result_cache
+        cache_key = None
+        if cache is not None and is_cacheable(sql_statement):
+            cache_key = cache.make_key(sql_statement, await self.connection.aget_session_context(session))
+            cached_result = await asyncio.to_thread(cache.get, cache_key)
+            if cached_result is not None:
+                query_id, query_df = cached_result
+                logger.info(f"Using the cached result of SQL query {query_id}.")
+                yield QueryResultBatch(query_id=query_id, tool_use_id=sql_tool_use_id, batch_index=0, rows=query_df)
+                yield UserResult(
+                    tool_name=sql_tool_name,
+                    tool_use_id=sql_tool_use_id,
+                    query_id=query_id,
+                    query_result=self.connection.result_store.put(query_id, query_df)
+                )
+                return
+        elif cache is not None:
+            # e.g. USE ROLE or ALTER SESSION, the cached context of the session may be outdated
+            self.connection.reset_session_context(session)
+        query = await asubmit_sql(session, sql_statement)
+        logger.info(f"Executing SQL query {query.query_id}.")
+        await await_query(session, query, policy)
+        batches = []
+        async with aclosing(aiter_result_batches(query, policy)) as result_batches:
+            async for batch in result_batches:
+                yield QueryResultBatch(query_id=query.query_id, tool_use_id=sql_tool_use_id, batch_index=len(batches), rows=batch)
+                batches.append(batch)
+        query_df = pd.concat(batches, ignore_index=True) if len(batches) > 1 else (batches[0] if batches else pd.DataFrame())
+        if policy.compact_dtypes:
+            query_df = compact_dtypes(query_df, downcast_numerics=policy.downcast_numerics)
+        if cache_key is not None:
+            await asyncio.to_thread(cache.put, cache_key, query.query_id, query_df)
+        yield UserResult(
+            tool_name=sql_tool_name,
+            tool_use_id=sql_tool_use_id,
+            query_id=query.query_id,
+            query_result=self.connection.result_store.put(query.query_id, query_df)
+        )
+
+    def make_request(self, content, role:str = None, should_continue: Optional[Callable[[TurnStep], bool]] = None) -> Generator:
         """
         Sends a message to the agent and yields streamed responses.
 
         Args:
-            content (str or UserResult): Input content to send to the agent.
+            content (str, UserResult or List[UserResult]): Input content to send to the agent.
             role (str): The role of the message sender, typically 'user'.
+            should_continue (Optional[Callable[[TurnStep], bool]]): Called after every step that executed SQL; returning False ends the turn early.
 
         Yields:
             Event data or processed output depending on the agent's response.
         """
-        # Add wrapper function to provide a synchronous interface
-        return self._sync_request_wrapper(content, role)
+        # Drive the async request on the background event loop to provide a synchronous interface
+        return iterate_in_background_loop(self.amake_request(content, role, should_continue=should_continue))
 
-    def _sync_request_wrapper(self, content, role:str = None) -> Generator:
-        """Wrapper to convert async operations to a synchronous generator."""
-        if not role:
-            message = Message(role='user', content=content)
-            self.message_history.add(message)
-        elif role == 'user':
-            message = Message(role='user', content=content)
-            self.message_history.add(message)
+    async def amake_request(self, content, role:str = None, deadline: Optional[float] = None, should_continue: Optional[Callable[[TurnStep], bool]] = None) -> AsyncGenerator:
+        """
+        Sends a message to the agent and asynchronously yields streamed responses.
 
-        headers, body = self._build_request()
-        
-        # Create event loop
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        # Create the queue and run the async task
-        queue = asyncio.Queue()
+        Events are streamed directly from the API. If the agent requests client-side
+        SQL executions, all queries of the step run concurrently, their result batches are
+        yielded as QueryResultBatch objects while they are downloaded, and the results are sent
+        back to the agent in one message. With SQLExecutionPolicy.start_during_stream, queries
+        are submitted as soon as their tool use arrives.
 
-        yield message
-        task = loop.create_task(self._async_request_to_queue(headers, body, queue))
-        
-        # Yield items as they become available
+        Agent calls and SQL executions alternate in a single loop until the agent answers without
+        requesting SQL, the configuration's max_steps is reached or should_continue returns False.
+        The timings of the steps are recorded in turn_steps. SQL requested by the last allowed step
+        is answered with error tool results, and a turn that ends before the agent answered is
+        closed with an assistant message stating why, so every tool use in the history stays
+        paired with a result and the roles keep alternating. Both messages are yielded. A turn
+        that is cancelled or fails, e.g. with a SQL timeout, is closed the same way before the
+        exception is raised.
+
+        Args:
+            content (str, UserResult or List[UserResult]): Input content to send to the agent.
+            role (str): The role of the message sender, typically 'user'.
+            deadline (Optional[float]): Event loop time by which the whole turn must be finished.
+                Defaults to the connection's turn timeout.
+            should_continue (Optional[Callable[[TurnStep], bool]]): Called after every step that executed SQL;
+                returning False ends the turn early, after the results were added to the message history.
+                The turn is then closed with an assistant message.
+
+        Yields:
+            Event data or processed output depending on the agent's response.
+        """
+        loop = asyncio.get_running_loop()
+        if deadline is None and self.connection.timeouts.turn is not None:
+            deadline = loop.time() + self.connection.timeouts.turn
+
+        if not role or role == 'user':
+            message = Message(role='user', content=content)
+
+        max_steps = self.configuration.max_steps
+        self.turn_steps = []
+        # all steps of the turn run their SQL on the same pooled session
+        turn_session = _TurnSession(self.connection)
         try:
             while True:
+                step = TurnStep(index=len(self.turn_steps))
+                self.turn_steps.append(step)
+                self.message_history.add(message)
+                started_at = loop.time()
+                await self._afit_context_window()
+                headers, body = self._build_request()
+                yield message
+
+                sql_execution_tasks = _SQLExecutionTasks(self._aexecute_sql, turn_session)
+                on_content = None
+                if self.connection.sql_execution.start_during_stream:
+                    sql_exec_tool_names = [tool.name for tool in self.configuration._get_sql_exec_tools()]
+                    def on_content(content):
+                        sql_execution = self._get_sql_execution(content, sql_exec_tool_names)
+                        if sql_execution is not None:
+                            logger.debug(f"Starting SQL execution for tool use {sql_execution[1]} while the response is streaming.")
+                            sql_execution_tasks.start(sql_execution)
                 try:
-                    item = loop.run_until_complete(queue.get())
-                    if item is None:  # Signal for end of stream
-                        break
-                    yield item
-                except asyncio.CancelledError:
-                    break
-        
-        finally:
-            # Check for SQL execution after completing the stream
-            sql_tool_name, sql_tool_use_id, sql_statement = self._check_if_sql_execution_requested()
-            if sql_statement:
-                query = self.connection.session.sql(sql_statement).collect(block=False)
-                while not query.is_done():
-                    logger.info('Still executing SQL Query ...')
-                query_results = UserResult(
-                    tool_name=sql_tool_name, 
-                    tool_use_id=sql_tool_use_id, 
-                    query_id=query.query_id, 
-                    query_df=pd.DataFrame(query.result())
-                )
-                # Use yield from to delegate to another generator
-                yield from self.make_request(role='user', content=query_results)
+                    async with aclosing(self._make_async_request(headers, body, deadline=deadline, on_content=on_content)) as events:
+                        async for event in events:
+                            yield event
+                    step.agent_seconds = loop.time() - started_at
 
-    async def _async_request_to_queue(self, headers, body, queue):
-        """Process async requests and put results into the provided queue."""
-        try:
-            async for event in self._make_async_request(headers, body):
-                await queue.put(event)
-        except Exception as e:
-            logger.error(f"Error during async request: {e}")
-            # Optionally put the exception in the queue to be raised in the main thread
-            await queue.put(e)
+                    sql_executions = self._check_if_sql_execution_requested()
+                    if sql_executions and max_steps is not None and len(self.turn_steps) >= max_steps:
+                        logger.warning(f"Turn reached the limit of {max_steps} steps, not executing the {len(sql_executions)} SQL statements requested in the last step.")
+                        for message in self._close_turn(f"The turn reached its limit of {max_steps} steps before the requested SQL was executed."):
+                            yield message
+                        return
+                    if sql_executions:
+                        started_at = loop.time()
+                        try:
+                            async with asyncio.timeout_at(deadline) as timer:
+                                async with aclosing(sql_execution_tasks.results(sql_executions)) as results:
+                                    async for result in results:
+                                        if isinstance(result, list):
+                                            query_results = result
+                                        else:
+                                            # the deadline must not cancel the consumer while it handles a batch
+                                            timer.reschedule(None)
+                                            yield result
+                                            timer.reschedule(deadline)
+                        except CortexAgentTimeoutError:
+                            # SQL and session pool timeouts keep their own type
+                            raise
+                        except TimeoutError:
+                            if deadline is None or loop.time() < deadline:
+                                raise
+                            raise CortexAgentDeadlineExceededError(f"Turn exceeded its deadline of {self.connection.timeouts.turn}s while executing SQL.", self.connection.timeouts.turn) from None
+                        step.sql_seconds = loop.time() - started_at
+                        step.sql_executions = len(sql_executions)
+                finally:
+                    # executions started during a failed or abandoned stream
+                    await sql_execution_tasks.aclose()
+                logger.debug(f"Step {step.index} of the turn took {step.agent_seconds:.2f}s for the agent call and {step.sql_seconds:.2f}s for {step.sql_executions} SQL executions.")
+
+                if not sql_executions:
+                    return
+                message = Message(role='user', content=query_results)
+                if should_continue is not None and not should_continue(step):
+                    logger.info(f"Turn stopped early after step {step.index}.")
+                    self.message_history.add(message)
+                    yield message
+                    for message in self._close_turn(f"The turn was stopped after step {step.index} before the agent answered."):
+                        yield message
+                    return
+        except BaseException as e:
+            # keep the message history valid for the next turn when the turn was cancelled or failed
+            self._close_turn("The turn was cancelled." if isinstance(e, (GeneratorExit, asyncio.CancelledError)) else f"The turn failed: {e}")
+            raise
         finally:
-            # Signal end of stream
-            await queue.put(None)
+            turn_session.release()
+
+    def _close_turn(self, reason: str) -> List[Message]:
+        """
+        Ends a turn before the agent answered, so that the roles in the message history keep alternating.
+
+        Unanswered SQL tool uses of the last assistant message get error tool results, and the turn
+        is closed with an assistant message stating the reason.
+
+        Returns:
+            List[Message]: The messages added to the message history.
+        """
+        if not len(self.message_history):
+            return []
+        messages = []
+        sql_executions = self._check_if_sql_execution_requested()
+        if sql_executions:
+            messages.append(Message(role='user', content=[
+                UserToolError(tool_name=sql_tool_name, tool_use_id=sql_tool_use_id, message=reason)
+                for sql_tool_name, sql_tool_use_id, _ in sql_executions
+            ]))
+        elif self.message_history[-1]['role'] != 'user':
+            return []
+        messages.append(Message(role='assistant', content=reason))
+        for message in messages:
+            self.message_history.add(message)
+        return messages
 
 class CortexLLMAPIHandler:
     """
@@ -201,7 +673,7 @@ class CortexLLMAPIHandler:
     def __init__(self, connection: CortexAgentConnection, configuration: CortexAgentConfiguration):
         self.connection = connection
         self.configuration = configuration
-        self.api_history = AgentAPIHistory()
+        self.api_history = AgentAPIHistory(level=configuration.api_history_level, max_entries=configuration.api_history_max_entries, store=configuration.api_history_store)
         self.message_history = AgentMessageHistory()
 
     def _build_request(self):
@@ -222,28 +694,14 @@ class CortexLLMAPIHandler:
         body['messages'] = self.message_history.format_for_llm_call()
         return headers, body
     
-    async def _make_async_request(self, headers:dict, body:dict):
-        self.api_history.add(header=headers, event=body)
-        all_events_from_response = []
-        async with AsyncClient(timeout=None) as client:
-            async with aconnect_sse(
-                client,
-                method="POST",
-                url=f'https://{self.connection.account_url}/api/v2/cortex/inference:complete',
-                json=body,
-                headers=headers
-            ) as event_source:
-                if event_source.response.status_code == 200:
-                    async for event in event_source.aiter_sse():
-                        yield event # yielding SSE
-                        self.api_history.add(header=event_source.response.headers, event=event)
-                        all_events_from_response.append(event)
-                else:
-                    error_text = await event_source.response.aread()
-                    raise Exception(f"Agent got a bad API response: {event_source.response.status_code} - {error_text.decode()}")
-                events_for_message_history = format_events_for_llm_message_history(all_events_from_response)
-                message = Message(role='assistant', content=events_for_message_history)
-                self.message_history.add(message)
+    async def _make_async_request(self, headers:dict, body:dict, deadline: Optional[float] = None):
+        message_builder = LLMMessageBuilder()
+        async with aclosing(_stream_events(self.connection, self.connection.CORTEX_API_ENDPOINT, headers, body, self.api_history, deadline=deadline)) as events:
+            async for event in events:
+                yield event
+                message_builder.add(event)
+        message = Message(role='assistant', content=message_builder.build())
+        self.message_history.add(message)
 
     def make_request(self, content, role:str = None) -> Generator:
         """
@@ -256,48 +714,30 @@ class CortexLLMAPIHandler:
         Yields:
             Event data or processed output depending on the agent's response.
         """
-        # Add wrapper function to provide a synchronous interface
-        return self._sync_request_wrapper(content, role)
+        # Drive the async request on the background event loop to provide a synchronous interface
+        return iterate_in_background_loop(self.amake_request(content, role))
+
+    async def amake_request(self, content, role:str = None) -> AsyncGenerator:
+        """
+        Sends a message to the LLM and asynchronously yields streamed responses.
+
+        Args:
+            content (str): Input content to send to the LLM.
+            role (str): The role of the message sender, typically 'user'.
+
+        Yields:
+            Event data or processed output depending on the LLM's response.
+        """
+        deadline = None
+        if self.connection.timeouts.turn is not None:
+            deadline = asyncio.get_running_loop().time() + self.connection.timeouts.turn
 
-    def _sync_request_wrapper(self, content, role:str = None) -> Generator:
         if not role:
             message = Message(role='user', content=content)
             self.message_history.add(message)
 
         headers, body = self._build_request()
-        
-        # Create event loop
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        # Create the queue and run the async task
-        queue = asyncio.Queue()
-
         yield message
-        task = loop.create_task(self._async_request_to_queue(headers, body, queue))
-        
-        # Yield items as they become available
-        while True:
-            try:
-                item = loop.run_until_complete(queue.get())
-                if item is None:  # Signal for end of stream
-                    break
-                yield item
-            except asyncio.CancelledError:
-                break
-
-    async def _async_request_to_queue(self, headers, body, queue):
-        """Process async requests and put results into the provided queue."""
-        try:
-            async for event in self._make_async_request(headers, body):
-                await queue.put(event)
-        except Exception as e:
-            logger.error(f"Error during async request: {e}")
-            # Optionally put the exception in the queue to be raised in the main thread
-            await queue.put(e)
-        finally:
-            # Signal end of stream
-            await queue.put(None)
+        async with aclosing(self._make_async_request(headers, body, deadline=deadline)) as events:
+            async for event in events:
+                yield event
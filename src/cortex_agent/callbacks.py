@@ -1,7 +1,7 @@
 from typing import Union
 from httpx_sse._models import ServerSentEvent
 #from .agent import CortexAgent
-from cortex_agent.message_formats import Message
+from cortex_agent.message_formats import Message, QueryResultBatch, to_typed_events
 import json
 import pandas as pd
 from rich.console import Console, Group
@@ -81,7 +81,7 @@ class ConsoleCallback:
         self.sql_exec_names = [tool.name for tool in agent.configuration.tools if tool.type == 'sql_exec']
         self.data_to_chart_names = ['data_to_chart'] # always data_to_chart #[tool.name for tool in agent.configuration.tools if tool.type == 'data_to_chart']
         self.console = Console()
-        self.text_output = ''
+        self.text_chunks = []
         self.last_tool_name = None # temporary bugfix, since tool_results.name is empty for Cortex Search
         self.user_prompt = ''
 
@@ -103,11 +103,11 @@ class ConsoleCallback:
                             console.print(text_panel)
                         yield capture.get()
 
-                if message['content'][0]['type'] == 'tool_results':
-                    if self.display_tool_results_data:
-                        tool_name = message['content'][0]['tool_results']['name']
-                        query_id = message['content'][0]['tool_results']['content'][0]['json']['query_id']
-                        df = message['content'][0]['tool_results']['content'][0]['json']['query_df']
+                for content in message['content']:
+                    if content['type'] == 'tool_results' and content['tool_results'].get('status') != 'error' and self.display_tool_results_data:
+                        tool_name = content['tool_results']['name']
+                        query_id = content['tool_results']['content'][0]['json']['query_id']
+                        df = content['tool_results']['content'][0]['json']['query_result'].to_pandas()
                         sql_result_panel = Panel(df_to_rich_table(df), title=f"[bold black]SQL Results (Query-ID:{query_id})", padding=self.panel_padding)
                         if self.console_print:
                             console.print(sql_result_panel)
@@ -115,22 +115,31 @@ class ConsoleCallback:
                             with console.capture() as capture:
                                 console.print(sql_result_panel)
                             yield capture.get()
+                    elif content['type'] == 'tool_results' and self.display_tool_results_data:
+                        error_panel = Panel(content['tool_results']['content'][0]['text'], title=f"[bold black]SQL not executed:", padding=self.panel_padding)
+                        if self.console_print:
+                            console.print(error_panel)
+                        else:
+                            with console.capture() as capture:
+                                console.print(error_panel)
+                            yield capture.get()
         if isinstance(message, ServerSentEvent):
             event = message
             if event.event == "done":
-                if self.text_output != '':
+                text_output = ''.join(self.text_chunks)
+                self.text_chunks = []
+                if text_output != '':
                     if self.enable_markdown:
-                        self.text_output = Markdown(self.text_output)
-                    text_panel = Panel(self.text_output, title=f"[bold black]Text response:", padding=self.outer_panel_padding)
+                        text_output = Markdown(text_output)
+                    text_panel = Panel(text_output, title=f"[bold black]Text response:", padding=self.outer_panel_padding)
                     if self.console_print:
                         console.print(text_panel)
                     else:
                         with console.capture() as capture:
                             console.print(text_panel)
                         yield capture.get()
-                    self.text_output = ''
             if event.event == "message.delta":
-                data = json.loads(event.data)
+                data = event.json()
                 if "delta" in data and "content" in data["delta"]:
                     for content in data['delta']['content']:
 
@@ -276,7 +285,7 @@ class ConsoleCallback:
 
                         if content.get('type') == 'text':
                             if self.display_text_results:
-                                self.text_output += content['text'].replace('【', '[').replace('】', ']')
+                                self.text_chunks.append(content['text'].replace('【', '[').replace('】', ']'))
 
 
 class ConversationalCallback:
@@ -321,8 +330,18 @@ class ConversationalCallback:
         self.last_tool_name = None # temporary bugfix, since tool_results.name is empty for Cortex Search
         self.first_text_response = True
         self.user_prompt = ''
+        self.streamed_results = set() # tool use ids whose SQL results were shown batch by batch
+
+    def __call__(self, message: Union[Message, ServerSentEvent, QueryResultBatch]):
+        if isinstance(message, QueryResultBatch):
+            if self.display_tool_results_data:
+                # every batch is shown as soon as it is downloaded, not once the whole result is there
+                text = [f"{message.rows.to_markdown()}", '\n']
+                if message.batch_index == 0:
+                    text = [f"User:", f"These are the results of the executed SQL Query with Query-ID: {message.query_id})"] + text
+                self.streamed_results.add(message.tool_use_id)
+                yield "\n".join(text)
 
-    def __call__(self, message: Union[Message, ServerSentEvent]):
         if isinstance(message, Message):
             if message['role'] == 'user':
                 if message['content'][0]['type'] == 'text':
@@ -334,11 +353,14 @@ class ConversationalCallback:
                     yield "\n".join(text)
                     self.user_prompt = message['content'][0]['text']
 
-                if message['content'][0]['type'] == 'tool_results':
-                    if self.display_tool_results_data:
-                        tool_name = message['content'][0]['tool_results']['name']
-                        query_id = message['content'][0]['tool_results']['content'][0]['json']['query_id']
-                        df = message['content'][0]['tool_results']['content'][0]['json']['query_df']
+                for content in message['content']:
+                    if content['type'] == 'tool_results' and content['tool_results']['tool_use_id'] in self.streamed_results:
+                        # already shown batch by batch
+                        self.streamed_results.discard(content['tool_results']['tool_use_id'])
+                    elif content['type'] == 'tool_results' and content['tool_results'].get('status') != 'error' and self.display_tool_results_data:
+                        tool_name = content['tool_results']['name']
+                        query_id = content['tool_results']['content'][0]['json']['query_id']
+                        df = content['tool_results']['content'][0]['json']['query_result'].to_pandas()
                         text = [
                             f"User:",
                             f"These are the results of the executed SQL Query with Query-ID: {query_id})",
@@ -346,6 +368,13 @@ class ConversationalCallback:
                             '\n'
                         ]
                         yield "\n".join(text)
+                    elif content['type'] == 'tool_results' and self.display_tool_results_data:
+                        text = [
+                            f"User:",
+                            f"The SQL Query was not executed: {content['tool_results']['content'][0]['text']}",
+                            '\n'
+                        ]
+                        yield "\n".join(text)
 
         if isinstance(message, ServerSentEvent):
             event = message
@@ -353,7 +382,7 @@ class ConversationalCallback:
                 self.text_output = ''
                 self.first_text_response = True
             if event.event == "message.delta":
-                data = json.loads(event.data)
+                data = event.json()
                 if "delta" in data and "content" in data["delta"]:
                     for content in data['delta']['content']:
 
@@ -495,7 +524,7 @@ class MinimalisticCallback:
             if message.event == "done":
                 self.first_text_response = True
             if message.event == 'message.delta':
-                data = json.loads(message.data)
+                data = message.json()
                 if data['delta']['content'][0]['type'] == 'text':
                     if self.first_text_response:
                         yield 'Assistant Message:\n'
@@ -503,6 +532,21 @@ class MinimalisticCallback:
                     yield data['delta']['content'][0]['text']
 
 
+class TypedEventCallback:
+    """
+    Callback that converts the agent stream into typed events.
+
+    Server-Sent Events are turned into TextDelta, ToolUse, ToolResult, SearchResults,
+    ChartSpec and Done objects (see message_formats). Messages, such as the user prompt
+    or SQL results sent back to the agent, and QueryResultBatch objects are passed through unchanged.
+    """
+    def __call__(self, message: Union[Message, ServerSentEvent, QueryResultBatch]):
+        if isinstance(message, (Message, QueryResultBatch)):
+            yield message
+        if isinstance(message, ServerSentEvent):
+            yield from to_typed_events(message)
+
+
 class StreamlitCallback:
     def __init__(self, agent, **kwargs):
         self.agent = agent
@@ -530,17 +574,27 @@ class StreamlitCallback:
         self.search_service_names = [tool.name for tool in agent.configuration.tools if tool.type == 'cortex_search']
         self.sql_exec_names = [tool.name for tool in agent.configuration.tools if tool.type == 'sql_exec']
         self.data_to_chart_names = ['data_to_chart'] # always data_to_chart #[tool.name for tool in agent.configuration.tools if tool.type == 'data_to_chart']
-        self.text_response = ''
+        self.text_chunks = []
         self.last_tool_name = None # temporary bugfix, since tool_results.name is empty for Cortex Search
         self.first_text_response = True
         self.user_prompt = ''
+        self.result_placeholders = {} # tool use id -> placeholder showing the first batch of its SQL results
 
     def response_streamer(self, text_response):
         for char in text_response:
             yield char
             time.sleep(0.007)
 
-    def __call__(self, message: Union[Message, ServerSentEvent]):
+    def __call__(self, message: Union[Message, ServerSentEvent, QueryResultBatch]):
+        if isinstance(message, QueryResultBatch):
+            if self.display_tool_results_data and message.batch_index == 0:
+                # show the first batch while the rest downloads, it is replaced by the full result later
+                chat_message = st.chat_message('user')
+                chat_message.write(f"These are the results of the executed SQL Query with Query-ID: {message.query_id})")
+                placeholder = chat_message.empty()
+                placeholder.dataframe(message.rows)
+                self.result_placeholders[message.tool_use_id] = placeholder
+
         if isinstance(message, Message):
             if message['role'] == 'user':
                 if message['content'][0]['type'] == 'text':
@@ -549,32 +603,39 @@ class StreamlitCallback:
                     chat_message.write(text)
                     self.user_prompt = text
 
-            if message['content'][0]['type'] == 'tool_results':
-                if self.display_tool_results_data:
-                    tool_name = message['content'][0]['tool_results']['name']
-                    query_id = message['content'][0]['tool_results']['content'][0]['json']['query_id']
-                    df = message['content'][0]['tool_results']['content'][0]['json']['query_df']
+            for content in message['content']:
+                if content['type'] == 'tool_results' and content['tool_results'].get('status') != 'error' and self.display_tool_results_data:
+                    tool_name = content['tool_results']['name']
+                    query_id = content['tool_results']['content'][0]['json']['query_id']
+                    df = content['tool_results']['content'][0]['json']['query_result'].to_pandas()
+                    placeholder = self.result_placeholders.pop(content['tool_results']['tool_use_id'], None)
+                    if placeholder is not None:
+                        placeholder.dataframe(df)
+                        continue
                     chat_message = st.chat_message('user')
                     if self.streamed_responses:
                         chat_message.write_stream(self.response_streamer(f"These are the results of the executed SQL Query with Query-ID: {query_id})"))
                     else:
                         chat_message.write(f"These are the results of the executed SQL Query with Query-ID: {query_id})")
                     chat_message.dataframe(df)
+                elif content['type'] == 'tool_results' and self.display_tool_results_data:
+                    st.chat_message('user').write(f"The SQL Query was not executed: {content['tool_results']['content'][0]['text']}")
         if isinstance(message, ServerSentEvent):
             event = message
             if event.event == "done":
+                text_response = ''.join(self.text_chunks)
+                self.text_chunks = []
                 if self.display_text_results:
-                    if self.text_response != '':
+                    if text_response != '':
                         chat_message = st.chat_message('ai')
                         if self.streamed_responses:
-                            chat_message.write_stream(self.response_streamer(self.text_response))
+                            chat_message.write_stream(self.response_streamer(text_response))
                         else:
-                            chat_message.write(self.text_response)
-                self.text_response = ''
+                            chat_message.write(text_response)
                 self.first_text_response = True
 
             if event.event == "message.delta":
-                data = json.loads(event.data)
+                data = event.json()
                 if "delta" in data and "content" in data["delta"]:
                     for content in data['delta']['content']:
                         if content['type'] == 'tool_use':
@@ -693,7 +754,7 @@ class StreamlitCallback:
                                 
                         
                         if content.get('type') == 'text':
-                            self.text_response += content["text"]
+                            self.text_chunks.append(content["text"])
 
 
 class StreamlitMessageHandler:
@@ -737,17 +798,19 @@ class StreamlitMessageHandler:
                 chat_message.write(text)
                 self.user_prompt = text
 
-            if message['content'][0]['type'] == 'tool_results':
-                if self.display_tool_results_data:
-                    tool_name = message['content'][0]['tool_results']['name']
-                    query_id = message['content'][0]['tool_results']['content'][0]['json']['query_id']
-                    df = message['content'][0]['tool_results']['content'][0]['json']['query_df']
+            for content in message['content']:
+                if content['type'] == 'tool_results' and content['tool_results'].get('status') != 'error' and self.display_tool_results_data:
+                    tool_name = content['tool_results']['name']
+                    query_id = content['tool_results']['content'][0]['json']['query_id']
+                    df = content['tool_results']['content'][0]['json']['query_result'].to_pandas()
                     chat_message = st.chat_message('user')
                     if self.streamed_responses:
                         chat_message.write_stream(self.response_streamer(f"These are the results of the executed SQL Query with Query-ID: {query_id})"))
                     else:
                         chat_message.write(f"These are the results of the executed SQL Query with Query-ID: {query_id})")
                     chat_message.dataframe(df)
+                elif content['type'] == 'tool_results' and self.display_tool_results_data:
+                    st.chat_message('user').write(f"The SQL Query was not executed: {content['tool_results']['content'][0]['text']}")
 
         if message['role'] == 'assistant':
             for content in message['content']:
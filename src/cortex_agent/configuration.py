@@ -1,18 +1,22 @@
 from dataclasses import dataclass, field
 import logging
-from typing import Optional, List
+from typing import Optional, List, TYPE_CHECKING
 from .tool_resources import CortexAgentToolResource, CortexAnalystService, CortexSearchService
 from .tools import CortexAgentTool
+from .message_formats import ALLOWED_API_HISTORY_LEVELS
 from snowflake.snowpark import Session
 from snowflake.snowpark.types import StructType, StructField, StringType, VariantType
 from snowflake.snowpark import functions as F
 from cortex_agent.tools import CortexAgentTool
+if TYPE_CHECKING:
+    from .history_store import JSONLHistoryStore
 import json 
 import logging
 logger = logging.getLogger("cortex_agent.configuration")
 
 ALLOWED_MODELS = ['claude-3-5-sonnet','mistral-large2','llama3.3-70b','llama3.1-70b']
 ALLOWED_TOOL_CHOICES = ['auto', 'required', 'tool']
+ALLOWED_CONTEXT_OVERFLOW_STRATEGIES = ['drop', 'summarize']
 
 @dataclass
 class CortexAgentConfiguration:
@@ -28,6 +32,13 @@ class CortexAgentConfiguration:
         tool_resources (List[CortexAgentToolResource]): List of tool resource configurations.
         tool_choice (dict): Strategy for tool selection (default is auto).
         response_instruction (Optional[str]): Custom instructions for generating responses.
+        api_history_level (str): How much of the API traffic is recorded: 'off', 'metadata' (default) or 'full'. 'full' keeps every request body and response event, including query results, so opt in only for debugging or with an api_history_store.
+        api_history_max_entries (Optional[int]): Maximum number of API history entries kept per handler (None for unbounded).
+        api_history_store (Optional[JSONLHistoryStore]): Backend the API history is recorded to instead of memory, shared by all handlers using this configuration.
+        context_token_budget (Optional[int]): Maximum estimated number of tokens of the conversation sent with each request (None for unlimited).
+        compact_after_turns (Optional[int]): Number of most recent turns sent with their full tool payloads; older search results, analyst results and charts are replaced by short stubs (None disables compaction).
+        context_overflow (str): What happens to the oldest turns above the budget: 'drop' removes them, 'summarize' replaces them with a summary created with complete().
+        max_steps (Optional[int]): Maximum number of agent calls per turn; SQL requested by the last allowed call is not executed (None for unlimited).
     """
     model: Optional[str] = 'claude-3-5-sonnet'
     tools: Optional[List[CortexAgentTool]] = field(default_factory=list)
@@ -35,6 +46,21 @@ class CortexAgentConfiguration:
     tool_choice: Optional[dict] = field(default_factory=lambda: {'type': 'auto'})
     response_instruction: Optional[str] = ''
     experimental: Optional[str] = field(default_factory=lambda: {})
+    api_history_level: str = 'metadata'
+    api_history_max_entries: Optional[int] = 10000
+    api_history_store: Optional['JSONLHistoryStore'] = None
+    context_token_budget: Optional[int] = None
+    compact_after_turns: Optional[int] = 3
+    context_overflow: str = 'drop'
+    max_steps: Optional[int] = 10
+
+    def __post_init__(self):
+        if self.context_overflow not in ALLOWED_CONTEXT_OVERFLOW_STRATEGIES:
+            raise ValueError(f"Invalid context overflow strategy: '{self.context_overflow}'. Must be one of {ALLOWED_CONTEXT_OVERFLOW_STRATEGIES}")
+        if self.api_history_level not in ALLOWED_API_HISTORY_LEVELS:
+            raise ValueError(f"Invalid API history level: '{self.api_history_level}'. Must be one of {ALLOWED_API_HISTORY_LEVELS}")
+        if self.max_steps is not None and self.max_steps < 1:
+            raise ValueError("max_steps must be at least 1.")
 
     def set_response_instruction(self, response_instruction:str = ''):
         """
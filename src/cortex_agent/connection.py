@@ -1,6 +1,6 @@
 from snowflake.snowpark.context import get_active_session
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Optional, Tuple
 from snowflake.snowpark import Session
 import logging
 from .jwt_generator import JWTGenerator
@@ -10,6 +10,16 @@ from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 import logging
 from .environment_checks import is_running_in_snowflake_notebook
+from .retry import RetryPolicy
+from .rate_limiter import RateLimit, get_token_bucket
+from .result_store import ResultStore, RESULT_STORE_MAX_BYTES
+from .sql_execution import SQLExecutionPolicy, aget_session_context
+from .sql_cache import SQLResultCache
+from .session_pool import SessionPool, SessionPoolPolicy
+import asyncio
+import threading
+import weakref
+import httpx
 
 logger = logging.getLogger("cortex_agent.connection")
 
@@ -18,6 +28,30 @@ API_TIMEOUT = 50000
 JWT_LIFE_TIME = 59
 JWT_RENEWAL = 54
 CORTEX_API_ENDPOINT = '/api/v2/cortex/inference:complete'
+SSE_DECODERS = ['httpx_sse', 'builtin']
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+
+@dataclass
+class RequestTimeouts:
+    """
+    Timeouts for calls to the Cortex REST APIs. All values are in seconds, None disables a timeout.
+
+    Attributes:
+        connect (Optional[float]): Maximum time to get a pooled connection, connect and send the request.
+        first_byte (Optional[float]): Maximum time from sending the request until the first event arrives.
+        idle (Optional[float]): Maximum time between two events of a response stream.
+        turn (Optional[float]): Deadline for a whole turn, covering the agent call, client-side SQL execution and follow-up calls.
+    """
+    connect: Optional[float] = 10.0
+    first_byte: Optional[float] = API_TIMEOUT / 1000
+    idle: Optional[float] = API_TIMEOUT / 1000
+    turn: Optional[float] = None
+
+    def to_httpx_timeout(self) -> httpx.Timeout:
+        """
+        Returns the transport level timeout. Reading the stream is guarded by the first_byte and idle timeouts instead.
+        """
+        return httpx.Timeout(connect=self.connect, read=None, write=self.connect, pool=self.connect)
 
 @dataclass
 class CortexAgentConnection:
@@ -42,6 +76,18 @@ class CortexAgentConnection:
         token (Optional[str]): Placeholder for a generated token.
         snowflake_token (Optional[str]): Token obtained from a Snowflake session.
         jwt_token (Optional[str]): JWT token generated for authentication.
+        http_limits (Optional[httpx.Limits]): Pool limits and keep-alive settings for the shared HTTP client.
+        retry_policy (Optional[RetryPolicy]): Retry behavior for failed calls to the agent and complete endpoints.
+        agent_rate_limit (Optional[RateLimit]): Client-side rate limit for the agent endpoint, shared by all connections to the same account.
+        complete_rate_limit (Optional[RateLimit]): Client-side rate limit for the complete endpoint, shared by all connections to the same account.
+        timeouts (Optional[RequestTimeouts]): Connect, first-byte, idle and turn timeouts for API calls.
+        sse_decoder (str): Decoder for response streams, either 'httpx_sse' or the faster 'builtin' byte-level decoder.
+        sql_execution (Optional[SQLExecutionPolicy]): Polling, timeout and cancellation of client-side SQL executions.
+        sql_result_cache (Optional[SQLResultCache]): Cache for the results of client-side SQL executions (None disables caching).
+        result_store_max_bytes (int): Memory budget for the results of client-side SQL executions kept in the result store.
+        result_store (ResultStore): Results of client-side SQL executions, shared by all requests using this connection.
+        session_pool_policy (Optional[SessionPoolPolicy]): Size and health checks of a pool of sessions for client-side SQL executions (None runs all SQL through session).
+        session_pool (Optional[SessionPool]): Sessions created from the connection parameters and the private key or programmatic access token.
     """
     session: Optional[Session] = None
     private_key_file: Optional[str] = None
@@ -52,11 +98,37 @@ class CortexAgentConnection:
     token: Optional[str] = None
     snowflake_token: Optional[str] = None
     jwt_token: Optional[str] = None
+    http_limits: Optional[httpx.Limits] = None
+    retry_policy: Optional[RetryPolicy] = None
+    agent_rate_limit: Optional[RateLimit] = None
+    complete_rate_limit: Optional[RateLimit] = None
+    timeouts: Optional[RequestTimeouts] = None
+    sse_decoder: str = 'httpx_sse'
+    sql_execution: Optional[SQLExecutionPolicy] = None
+    sql_result_cache: Optional[SQLResultCache] = None
+    result_store_max_bytes: int = RESULT_STORE_MAX_BYTES
+    session_pool_policy: Optional[SessionPoolPolicy] = None
 
     def __post_init__(self):
         self.CORTEX_API_ENDPOINT = CORTEX_API_ENDPOINT
         self.API_ENDPOINT = API_ENDPOINT
         self.API_TIMEOUT = API_TIMEOUT
+        if self.http_limits is None:
+            self.http_limits = HTTP_LIMITS
+        if self.retry_policy is None:
+            self.retry_policy = RetryPolicy()
+        if self.timeouts is None:
+            self.timeouts = RequestTimeouts()
+        if self.sql_execution is None:
+            self.sql_execution = SQLExecutionPolicy()
+        if self.sse_decoder not in SSE_DECODERS:
+            raise ValueError(f"Invalid SSE decoder: '{self.sse_decoder}'. Must be one of {SSE_DECODERS}")
+        self.result_store = ResultStore(max_bytes=self.result_store_max_bytes, get_session=lambda: self.session, policy=self.sql_execution)
+        # one pooled client per event loop, httpx connections can not be shared across loops
+        self._http_clients = weakref.WeakKeyDictionary()
+        self._http_clients_lock = threading.Lock()
+        # user, role, warehouse, database and schema per session, the cache key context of its SQL executions
+        self._session_contexts = weakref.WeakKeyDictionary()
         has_session = self.session is not None
         has_key_file = self.private_key_file is not None
         has_pat = self.programmatic_access_token is not None
@@ -102,6 +174,12 @@ class CortexAgentConnection:
             )
             raise ValueError("Invalid Authentication information. See log for details.")
 
+        self.session_pool = None
+        if self.session_pool_policy is not None:
+            if has_connection_parameters and (has_key_file or has_pat):
+                self.session_pool = SessionPool(create_session=self._create_session, policy=self.session_pool_policy)
+            else:
+                logger.warning("A session pool requires connection_parameters and a private key file or programmatic access token. Running all SQL through the provided session.")
 
 
     def _init_from_session(self):
@@ -197,12 +275,145 @@ class CortexAgentConnection:
         connection_parameters['password'] = programmatic_access_token
         return Session.builder.configs(connection_parameters).create()
     
+    def _create_session(self) -> Session:
+        """
+        Create another session with the credentials of this connection.
+        """
+        if self.programmatic_access_token is not None:
+            return self._create_session_from_programmatic_access_token(programmatic_access_token=self.programmatic_access_token, connection_parameters=self.connection_parameters)
+        return self._create_session_from_key(private_key_file=self.private_key_file, connection_parameters=self.connection_parameters)
+
+    async def aacquire_session(self) -> Session:
+        """
+        Check out a session for client-side SQL executions.
+
+        Returns a session from the session pool, or the connection's session if there is no pool.
+        Return it with release_session().
+        """
+        if self.session_pool is None:
+            return self.session
+        return await self.session_pool.aacquire()
+
+    def release_session(self, session: Session):
+        """
+        Return a session checked out with aacquire_session().
+        """
+        if self.session_pool is not None and session is not self.session:
+            self.session_pool.release(session)
+
+    async def aget_session_context(self, session: Session) -> Tuple[Optional[str], ...]:
+        """
+        Return the user, role, warehouse, database and schema of a session, queried only once per session.
+        """
+        context = self._session_contexts.get(session)
+        if context is None:
+            context = await aget_session_context(session)
+            self._session_contexts[session] = context
+        return context
+
+    def reset_session_context(self, session: Session):
+        """
+        Forget the context of a session, e.g. after a statement that may have changed its role or warehouse.
+        """
+        self._session_contexts.pop(session, None)
+
+    def get_http_client(self) -> httpx.AsyncClient:
+        """
+        Return the pooled HTTP client for the running event loop.
+
+        The client is created on first use and reused for all subsequent requests
+        from that loop, so DNS lookups, TCP connects and TLS handshakes are only paid once.
+        """
+        loop = asyncio.get_running_loop()
+        with self._http_clients_lock:
+            client = self._http_clients.get(loop)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(timeout=None, limits=self.http_limits)
+                self._http_clients[loop] = client
+        return client
+
+    async def acquire_rate_limit(self, endpoint: str) -> float:
+        """
+        Waits until the client-side rate limit of an endpoint allows another request.
+
+        Args:
+            endpoint (str): The API endpoint, e.g. API_ENDPOINT or CORTEX_API_ENDPOINT.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        rate_limit = {
+            self.API_ENDPOINT: self.agent_rate_limit,
+            self.CORTEX_API_ENDPOINT: self.complete_rate_limit
+        }.get(endpoint)
+        if rate_limit is None:
+            return 0.0
+        return await get_token_bucket(self.account_url, endpoint, rate_limit).acquire()
+
+    def close(self):
+        """
+        Close all pooled HTTP clients and pooled sessions owned by this connection.
+        """
+        if self.session_pool is not None:
+            self.session_pool.close()
+        with self._http_clients_lock:
+            clients = list(self._http_clients.items())
+            self._http_clients.clear()
+        for loop, client in clients:
+            _close_http_client(loop, client)
+
+    async def aclose(self):
+        """
+        Close all pooled HTTP clients and pooled sessions owned by this connection from within an event loop.
+        """
+        if self.session_pool is not None:
+            await asyncio.to_thread(self.session_pool.close)
+        running_loop = asyncio.get_running_loop()
+        with self._http_clients_lock:
+            clients = list(self._http_clients.items())
+            self._http_clients.clear()
+        for loop, client in clients:
+            if loop is running_loop:
+                await client.aclose()
+            else:
+                _close_http_client(loop, client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
     def __repr__(self):
         # Create a dictionary of attributes, excluding the token
-        attributes = {k: v for k, v in self.__dict__.items() if k not in ["jwt_token","snowflake_token","programmatic_access_token","connection_parameters"]}
+        attributes = {k: v for k, v in self.__dict__.items() if k not in ["jwt_token","snowflake_token","programmatic_access_token","connection_parameters"] and not k.startswith('_')}
         # include a placeholder for tokens if it's set
         attributes["jwt_token"] = "[OBFUSCATED]" if self.jwt_token is not None else None
         attributes["snowflake_token"] = "[OBFUSCATED]" if self.snowflake_token is not None else None
         attributes["programmatic_access_token"] = "[OBFUSCATED]" if self.programmatic_access_token is not None else None
         attributes["connection_parameters"] = "[OBFUSCATED]" if self.connection_parameters is not None else None
-        return f"{self.__class__.__name__}({attributes})"
\ No newline at end of file
+        return f"{self.__class__.__name__}({attributes})"
+
+def _close_http_client(loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient):
+    """
+    Close an AsyncClient on the event loop it was created on.
+    """
+    if loop.is_closed() or client.is_closed:
+        return
+    if not loop.is_running():
+        loop.run_until_complete(client.aclose())
+        return
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        loop.create_task(client.aclose())
+    else:
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop).result()
@@ -5,7 +5,7 @@ def is_running_in_notebook():
     Returns True if the code is running in an interactive notebook environment
     such as Jupyter, VSCode notebooks, or Google Colab.
 
-    Check is done to conditionally apply nest_asyncio.
+    Useful to adapt output to interactive environments.
     """
     try:
         from IPython import get_ipython
@@ -18,7 +18,7 @@ def is_running_in_snowflake_notebook():
     """
     Returns True if the code is running in an interactive snowflake notebook environment.
 
-    Check is done to conditionally apply nest_asyncio and format account-url.
+    Check is done to format the account-url and adapt the output of callbacks.
     """
     return os.environ.get("CONDA_PREFIX", "").startswith("/usr/lib/python_udf/")
 
@@ -12,16 +12,19 @@ class CortexAgentAPIError(CortexAgentError):
         error_code (int or str): The error code returned by the API.
         message (str): A descriptive error message.
         request_id (str): The unique identifier of the request that caused the error.
+        status_code (int): The HTTP status code of the response.
     """
-    def __init__(self, error_code, message, request_id):
+    def __init__(self, error_code, message, request_id, status_code=None):
         super().__init__(message)
         self.error_code = error_code
         self.message = message
         self.request_id = request_id
+        self.status_code = status_code
 
     def __str__(self):
         return (
             f"{self.__class__.__name__}: Snowflake Cortex Agent REST API returned an error. "
+            f"Status Code: {self.status_code} "
             f"Error Code: {self.error_code} "
             f'Error Message: "{self.message}" '
             f"Request-ID: {self.request_id}"
@@ -31,5 +34,54 @@ class CortexAgentAPIError(CortexAgentError):
             f"{self.__class__.__name__}("
             f"error_code={self.error_code}, "
             f"message={self.message!r}, "
-            f"request_id={self.request_id!r})"
+            f"request_id={self.request_id!r}, "
+            f"status_code={self.status_code})"
         )
+
+class CortexAgentTimeoutError(CortexAgentError, TimeoutError):
+    """
+    Base exception class for all timeouts while talking to the Cortex REST APIs.
+
+    Attributes:
+        timeout (float): The timeout in seconds that was exceeded.
+    """
+    def __init__(self, message, timeout=None):
+        super().__init__(message)
+        self.message = message
+        self.timeout = timeout
+
+class CortexAgentConnectTimeoutError(CortexAgentTimeoutError):
+    """
+    Exception raised when no connection to the API could be established in time.
+    """
+    pass
+
+class CortexAgentFirstByteTimeoutError(CortexAgentTimeoutError):
+    """
+    Exception raised when the API did not start streaming a response in time.
+    """
+    pass
+
+class CortexAgentIdleTimeoutError(CortexAgentTimeoutError):
+    """
+    Exception raised when a response stream stalled between two events.
+    """
+    pass
+
+class CortexAgentDeadlineExceededError(CortexAgentTimeoutError):
+    """
+    Exception raised when a turn, including client-side SQL execution and follow-up calls, exceeded its deadline.
+    """
+    pass
+
+class CortexAgentSQLTimeoutError(CortexAgentTimeoutError):
+    """
+    Exception raised when a SQL statement requested by the agent did not finish in time and was cancelled.
+    """
+    pass
+
+class CortexAgentSessionPoolTimeoutError(CortexAgentTimeoutError):
+    """
+    Exception raised when no pooled session for client-side SQL execution became available in time.
+    """
+    pass
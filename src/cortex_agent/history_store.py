@@ -0,0 +1,317 @@
+from typing import Dict, List, Optional, Tuple
+from queue import Empty, SimpleQueue
+import json
+import os
+import threading
+import logging
+from .message_formats import AgentAPIRequest, AgentAPIResponse
+from .sse import ParsedServerSentEvent
+
+logger = logging.getLogger("cortex_agent.history_store")
+
+_STOP = object()
+
+class JSONLHistoryStore:
+    """
+    Append-only store that spills the API history to rotating JSONL files.
+
+    Entries are serialized when they are recorded and written in batches by a background
+    writer thread, so the event loop never blocks on disk I/O. Only an offset index is kept
+    in memory; __getitem__ and __iter__ read the entries back lazily from disk.
+
+    Every line is one record. Requests are written again whenever their metadata (retries,
+    response header, event count) changes, and the index always points to the latest record.
+    Events refer to their request instead of repeating the response header.
+
+    A store can be shared by several handlers via CortexAgentConfiguration.api_history_store.
+    Files written by earlier store instances in the same directory are left untouched.
+
+    Args:
+        directory (str): Directory for the history files.
+        prefix (str): File name prefix; files are named '<prefix>-<number>.jsonl'.
+        max_file_bytes (int): Size after which the writer rotates to a new file.
+        max_files (Optional[int]): Number of files to keep; the oldest file and its entries are deleted first (None keeps all files).
+        batch_size (int): Maximum number of records written at once.
+    """
+    def __init__(self, directory: str, prefix: str = 'api_history', max_file_bytes: int = 64 * 1024 * 1024, max_files: Optional[int] = None, batch_size: int = 256):
+        if max_file_bytes <= 0:
+            raise ValueError("max_file_bytes must be greater than 0.")
+        if max_files is not None and max_files < 1:
+            raise ValueError("max_files must be at least 1.")
+        self.directory = directory
+        self.prefix = prefix
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.batch_size = batch_size
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        self._next_seq = 0
+        self._order: List[int] = []
+        self._index: Dict[int, Tuple[int, int, int]] = {}
+        self._open_requests: Dict[int, Tuple[AgentAPIRequest, int]] = {}
+        self._queued = 0
+        self._files: List[int] = []
+        self._file_number = self._last_file_number()
+        self._file = None
+        self._file_size = 0
+        self._closed = False
+        self._queue = SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, name='cortex-agent-history-writer', daemon=True)
+        self._writer.start()
+
+    def _path(self, file_number: int) -> str:
+        return os.path.join(self.directory, f'{self.prefix}-{file_number:05d}.jsonl')
+
+    def _last_file_number(self) -> int:
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(f'{self.prefix}-') and name.endswith('.jsonl'):
+                number = name[len(self.prefix) + 1:-len('.jsonl')]
+                if number.isdigit():
+                    numbers.append(int(number))
+        return max(numbers, default=-1)
+
+    def append(self, entry, request: Optional[AgentAPIRequest] = None):
+        """
+        Records a new entry.
+
+        Args:
+            entry (Union[AgentAPIRequest, AgentAPIResponse]): The entry to record.
+            request (Optional[AgentAPIRequest]): The request a response event belongs to.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The history store is closed.")
+            seq = self._next_seq
+            self._next_seq += 1
+            self._order.append(seq)
+            if isinstance(entry, AgentAPIRequest):
+                self._open_requests[id(entry)] = (entry, seq)
+                record = self._request_record(seq, entry)
+            else:
+                request_seq = self._open_requests.get(id(request), (None, None))[1] if request is not None else None
+                record = {
+                    'seq': seq,
+                    'type': 'event',
+                    'request': request_seq,
+                    'event': entry.event.event,
+                    'data': entry.event.data,
+                    'id': entry.event.id,
+                    'retry': entry.event.retry,
+                }
+            self._enqueue(seq, record)
+
+    def update(self, entry: AgentAPIRequest, final: bool = False):
+        """
+        Records the current metadata of a request again.
+
+        Args:
+            entry (AgentAPIRequest): A request previously passed to append().
+            final (bool): Whether the request is complete and no longer needs to be tracked.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            tracked = self._open_requests.pop(id(entry), None) if final else self._open_requests.get(id(entry))
+            if tracked is None:
+                return
+            seq = tracked[1]
+            self._enqueue(seq, self._request_record(seq, entry))
+
+    @staticmethod
+    def _request_record(seq: int, entry: AgentAPIRequest) -> dict:
+        return {
+            'seq': seq,
+            'type': 'request',
+            'header': entry.header,
+            'body': entry.body,
+            'retries': entry.retries,
+            'retry_wait': entry.retry_wait,
+            'rate_limit_wait': entry.rate_limit_wait,
+            'response_header': entry.response_header,
+            'event_count': entry.event_count,
+            'context_tokens': entry.context_tokens,
+        }
+
+    def _enqueue(self, seq: int, record: dict):
+        # serialize now, so later changes to the entry cannot race with the writer
+        line = json.dumps(record, default=str).encode() + b'\n'
+        self._queued += 1
+        self._queue.put((seq, line))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            stop = item is _STOP
+            if not stop:
+                batch.append(item)
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    logger.error(f"Error writing API history to {self.directory}: {e}")
+                with self._lock:
+                    self._queued -= len(batch)
+                    self._written.notify_all()
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write_batch(self, batch):
+        lines = []
+        positions = []
+        for seq, line in batch:
+            # rotate per record, so a batch never grows a file far beyond max_file_bytes
+            if self._file is None or self._file_size >= self.max_file_bytes:
+                self._write_lines(lines, positions)
+                lines, positions = [], []
+                self._rotate()
+            positions.append((seq, (self._file_number, self._file_size, len(line))))
+            lines.append(line)
+            self._file_size += len(line)
+        self._write_lines(lines, positions)
+
+    def _write_lines(self, lines, positions):
+        # the positions are only indexed once the lines are on disk
+        if not lines:
+            return
+        self._file.write(b''.join(lines))
+        self._file.flush()
+        with self._lock:
+            self._index.update(positions)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        self._file_number += 1
+        self._file = open(self._path(self._file_number), 'ab')
+        self._file_size = 0
+        self._files.append(self._file_number)
+        while self.max_files is not None and len(self._files) > self.max_files:
+            oldest = self._files.pop(0)
+            with self._lock:
+                dropped = {seq for seq, position in self._index.items() if position[0] == oldest}
+                for seq in dropped:
+                    del self._index[seq]
+                self._order = [seq for seq in self._order if seq not in dropped]
+            try:
+                os.remove(self._path(oldest))
+            except OSError as e:
+                logger.warning(f"Could not delete API history file {self._path(oldest)}: {e}")
+
+    def flush(self):
+        """
+        Blocks until all recorded entries have been written to disk.
+        """
+        with self._lock:
+            self._written.wait_for(lambda: self._queued == 0 or not self._writer.is_alive())
+
+    def close(self):
+        """
+        Writes all pending entries and stops the writer thread.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._writer.join()
+
+    def clear(self):
+        """
+        Forgets all entries recorded so far. The files on disk are kept.
+        """
+        self.flush()
+        with self._lock:
+            self._order = []
+            self._index = {}
+
+    def _position(self, seq: int) -> Optional[Tuple[int, int, int]]:
+        with self._lock:
+            return self._index.get(seq)
+
+    def _read(self, files: dict, position: Tuple[int, int, int]) -> dict:
+        file_number, offset, length = position
+        file = files.get(file_number)
+        if file is None:
+            file = files[file_number] = open(self._path(file_number), 'rb')
+        file.seek(offset)
+        return json.loads(file.read(length))
+
+    def _entry(self, record: dict, files: dict, headers: dict):
+        if record['type'] == 'request':
+            return AgentAPIRequest(
+                header=record['header'],
+                body=record['body'],
+                retries=record['retries'],
+                retry_wait=record['retry_wait'],
+                rate_limit_wait=record['rate_limit_wait'],
+                response_header=record['response_header'],
+                event_count=record['event_count'],
+                context_tokens=record.get('context_tokens'),
+            )
+        request_seq = record['request']
+        if request_seq not in headers:
+            header = None
+            position = self._position(request_seq) if request_seq is not None else None
+            if position is not None:
+                header = self._read(files, position)['response_header']
+            headers[request_seq] = header or {}
+        event = ParsedServerSentEvent(event=record['event'], data=record['data'], id=record['id'], retry=record['retry'])
+        return AgentAPIResponse(header=headers[request_seq], event=event)
+
+    def __iter__(self):
+        self.flush()
+        with self._lock:
+            order = list(self._order)
+        files, headers = {}, {}
+        try:
+            for seq in order:
+                position = self._position(seq)
+                if position is not None:
+                    yield self._entry(self._read(files, position), files, headers)
+        finally:
+            for file in files.values():
+                file.close()
+
+    def __getitem__(self, index):
+        self.flush()
+        # only the requested positions are looked up, the index is never copied. Entries appended
+        # after the flush, or whose write failed, have no position yet and are left out like in __iter__
+        with self._lock:
+            if isinstance(index, slice):
+                positions = [position for position in map(self._index.get, self._order[index]) if position is not None]
+            else:
+                position = self._index.get(self._order[index])
+                if position is None:
+                    raise IndexError(f"API history entry {index} has not been written to {self.directory} yet.")
+                positions = [position]
+        files, headers = {}, {}
+        try:
+            entries = [self._entry(self._read(files, position), files, headers) for position in positions]
+        finally:
+            for file in files.values():
+                file.close()
+        return entries if isinstance(index, slice) else entries[0]
+
+    def __len__(self):
+        self.flush()
+        with self._lock:
+            return len(self._order)
+
+    def __repr__(self):
+        return f"JSONLHistoryStore(directory={self.directory!r}, prefix={self.prefix!r}, max_file_bytes={self.max_file_bytes}, max_files={self.max_files})"
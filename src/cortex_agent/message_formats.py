@@ -1,9 +1,12 @@
 from dataclasses import dataclass, field
 from collections.abc import MutableMapping
-from typing import List, Any, Dict, Union
+from collections import deque
+from typing import List, Any, Dict, Union, Optional, Tuple
 import json
+import hashlib
+import itertools
 from httpx_sse._models import ServerSentEvent
-import copy
+from .result_store import QueryResultHandle
 import pandas as pd
 import logging
 
@@ -33,6 +36,10 @@ class Message(MutableMapping):
         elif role == 'user' and hasattr(content, 'to_dict'):
             self._data['content'] = [content.to_dict()]
 
+        elif role == 'user' and isinstance(content, list):
+            # e.g. the results of several SQL executions requested in the same turn
+            self._data['content'] = [item.to_dict() if hasattr(item, 'to_dict') else item for item in content]
+
         elif role == 'assistant' and isinstance(content, list):
             self._data['content'] = content
 
@@ -83,9 +90,12 @@ class UserResult:
         query_id (str): Query ID from of the executed SQL query
         tool_name (str): name of the sql_exec tool
         tool_use_id(str): id of the sql_exec tool
-        query_df (pd.DataFrame): pandas Dataframe with query results
+        query_df (pd.DataFrame): pandas Dataframe with query results, only used if no query_result is given
+        query_result (QueryResultHandle): handle to the query results in a ResultStore
     """
-    def __init__(self, query_id: str, tool_name: str, tool_use_id: str, query_df:pd.DataFrame):
+    def __init__(self, query_id: str, tool_name: str, tool_use_id: str, query_df:pd.DataFrame = None, query_result: QueryResultHandle = None):
+        if query_result is None:
+            query_result = QueryResultHandle(query_id=query_id, query_df=query_df)
         self.content = dict()
         self.content['type'] = 'tool_results'
         self.content['tool_results'] = dict()
@@ -95,19 +105,60 @@ class UserResult:
         self.content['tool_results']['content'][0]['type'] = 'json'
         self.content['tool_results']['content'][0]['json'] = dict()
         self.content['tool_results']['content'][0]['json']['query_id'] = query_id
-        self.content['tool_results']['content'][0]['json']['query_df'] = query_df
+        self.content['tool_results']['content'][0]['json']['query_result'] = query_result
+
+    def to_dict(self):
+        return self.content
+
+class UserToolError:
+    """
+    Wraps a tool use that was not executed, to be sent as a tool result with an error status.
+
+    Attributes:
+        tool_name (str): name of the tool
+        tool_use_id (str): id of the tool use
+        message (str): why the tool was not executed
+    """
+    def __init__(self, tool_name: str, tool_use_id: str, message: str):
+        self.content = dict()
+        self.content['type'] = 'tool_results'
+        self.content['tool_results'] = dict()
+        self.content['tool_results']['name'] = tool_name
+        self.content['tool_results']['tool_use_id'] = tool_use_id
+        self.content['tool_results']['status'] = 'error'
+        self.content['tool_results']['content'] = [{'type': 'text', 'text': message}]
 
     def to_dict(self):
         return self.content
     
 
+CLIENT_SIDE_RESULT_KEYS = ('query_df', 'query_result')
+
+def _to_api_message(message: dict) -> dict:
+    # rebuild only the parts that reference query results, everything else is shared
+    content = []
+    for item in message['content']:
+        if item.get('type') == 'tool_results':
+            results = item['tool_results']
+            results_content = []
+            for result in results.get('content', []):
+                if isinstance(result.get('json'), dict) and not result['json'].keys().isdisjoint(CLIENT_SIDE_RESULT_KEYS):
+                    result = {**result, 'json': {key: value for key, value in result['json'].items() if key not in CLIENT_SIDE_RESULT_KEYS}}
+                results_content.append(result)
+            item = {**item, 'tool_results': {**results, 'content': results_content}}
+        content.append(item)
+    return {**message, 'content': content}
+
+ALLOWED_API_HISTORY_LEVELS = ['off', 'metadata', 'full']
+REDACTED_HEADERS = ['authorization']
+
 @dataclass
 class AgentAPIResponse:
     """
     Represents an API response event from the Cortex Agent.
 
     Attributes:
-        header (dict): The response header details.
+        header (dict): The response header details, shared by all events of the same response.
         event (List[ServerSentEvent]): The event or events received in the response.
     """
     header: dict  
@@ -119,32 +170,134 @@ class AgentAPIRequest:
     Represents an API request event sent to the Cortex Agent.
 
     Attributes:
-        header (dict): The request header details.
-        body (List[Dict]): The body payload of the API request.
+        header (dict): The request header details with credentials redacted.
+        body (List[Dict]): The body payload of the API request (without messages when recording metadata only).
+        retries (int): Number of times the request was retried.
+        retry_wait (float): Total time in seconds spent waiting between retries.
+        rate_limit_wait (float): Total time in seconds spent waiting for the client-side rate limit.
+        response_header (Optional[dict]): The header of the successful response.
+        event_count (int): Number of events received in the response.
+        context_tokens (Optional[int]): Estimated number of tokens of the messages sent with the request.
     """
     header: dict  
     body: List[Dict]
+    retries: int = 0
+    retry_wait: float = 0.0
+    rate_limit_wait: float = 0.0
+    response_header: Optional[dict] = None
+    event_count: int = 0
+    context_tokens: Optional[int] = None
+
+def _redact_header(header) -> dict:
+    return {k: ('[OBFUSCATED]' if k.lower() in REDACTED_HEADERS else v) for k, v in header.items()}
 
 class AgentAPIHistory:
     """
     Maintains a history of API requests and responses exchanged with the Cortex Agent.
 
-    This is used for debugging and to reconstruct the conversation context for later API calls.
-    """
-    def __init__(self):
-        self.messages: List[AgentAPIResponse] = []
+    This is used for debugging and auditing. The recording level controls how much is kept:
+    - 'off': nothing is recorded.
+    - 'metadata': one entry per request with its response header, retries and event count, but no messages or events.
+    - 'full': every request and every response event.
 
-    def add(self, header: dict, event: Union[ServerSentEvent,Dict]):
-        if isinstance(event, ServerSentEvent):
-            self.messages.append(AgentAPIResponse(header=copy.deepcopy(header), event=event))
+    Response headers are stored once per response and shared by its events. Credentials
+    in request headers are redacted.
+
+    Entries are kept in memory unless a store is given, e.g. a JSONLHistoryStore that
+    spills them to disk and reads them back lazily.
+
+    Args:
+        level (str): Recording level, one of 'off', 'metadata' or 'full'.
+        max_entries (Optional[int]): Maximum number of entries to keep in memory; the oldest entries are dropped first.
+        store (Optional[JSONLHistoryStore]): Backend the entries are recorded to instead of memory.
+    """
+    def __init__(self, level: str = 'full', max_entries: Optional[int] = None, store = None):
+        if level not in ALLOWED_API_HISTORY_LEVELS:
+            raise ValueError(f"Invalid API history level: '{level}'. Must be one of {ALLOWED_API_HISTORY_LEVELS}")
+        self.level = level
+        self.max_entries = max_entries
+        self.store = store
+        self.messages = deque(maxlen=max_entries) if store is None else store
+
+    def add(self, header: dict, event: Union[ServerSentEvent,Dict], request: Optional[AgentAPIRequest] = None):
+        """
+        Records a request (event is the request body) or a response event.
+
+        Args:
+            header (dict): The request or response header.
+            event (Union[ServerSentEvent, Dict]): The request body or a response event.
+            request (Optional[AgentAPIRequest]): The request a response event belongs to.
+
+        Returns:
+            The recorded entry. Request entries are also returned if they are not kept, so that
+            callers can attach retry and response metadata to them.
+        """
         if isinstance(event, dict):
-            self.messages.append(AgentAPIRequest(header=copy.deepcopy(header), body=event))
+            body = event
+            if self.level != 'full':
+                body = {k: v for k, v in event.items() if k != 'messages'}
+            entry = AgentAPIRequest(header=_redact_header(header), body=body)
+            if self.level != 'off':
+                self.messages.append(entry)
+            return entry
+        if isinstance(event, ServerSentEvent):
+            if self.level != 'full':
+                return None
+            if not isinstance(header, dict):
+                header = dict(header)
+            entry = AgentAPIResponse(header=header, event=event)
+            if self.store is not None:
+                self.store.append(entry, request=request)
+            else:
+                self.messages.append(entry)
+            return entry
+
+    def add_response_header(self, request: AgentAPIRequest, header) -> dict:
+        """
+        Stores the header of a response once on its request entry.
+
+        Returns:
+            dict: The header to pass to add() for each event of this response.
+        """
+        request.response_header = dict(header)
+        if self.store is not None and self.level != 'off':
+            self.store.update(request)
+        return request.response_header
+
+    def finish_request(self, request: AgentAPIRequest):
+        """
+        Marks a request as complete once its response has been consumed or it failed.
+        """
+        if self.store is not None and self.level != 'off':
+            self.store.update(request, final=True)
+
+    def flush(self):
+        """
+        Blocks until all entries are written to the store.
+        """
+        if self.store is not None:
+            self.store.flush()
+
+    def clear(self):
+        """
+        Removes all recorded entries.
+        """
+        self.messages.clear()
 
     def __iter__(self):
         return iter(self.messages)
     
     def __getitem__(self, index):
+        if isinstance(index, slice) and isinstance(self.messages, deque):
+            # deques do not support slicing
+            start, stop, step = index.indices(len(self.messages))
+            if step > 0:
+                return list(itertools.islice(self.messages, start, stop, step))
+            return list(self.messages)[index]
         return self.messages[index]
+
+    def __len__(self):
+        return len(self.messages)
     
     def __str__(self):
         if not self.messages:
@@ -156,24 +309,109 @@ class AgentAPIHistory:
             return "[]"
         return "[\n  " + ",\n  ".join(repr(message) for message in self.messages) + "\n]"
     
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimates the number of tokens of a text, assuming about four characters per token.
+    """
+    return (len(text) + 3) // 4
+
+def _compact_tool_result(result: dict) -> dict:
+    payload = result.get('json')
+    if result.get('type') != 'json' or not isinstance(payload, dict):
+        return result
+    if payload.get('searchResults') is not None:
+        documents = [{key: doc[key] for key in ('doc_id', 'doc_title', 'source_id') if key in doc} for doc in payload['searchResults']]
+        return {**result, 'json': {'searchResults': documents}}
+    if payload.get('sql') is not None:
+        return {**result, 'json': {'sql': payload['sql']}}
+    if 'query_id' in payload:
+        return result
+    # e.g. the chart spec of data_to_chart
+    return {**result, 'json': {'sha256': _payload_hash(payload)}}
+
+def _payload_hash(payload) -> str:
+    if not isinstance(payload, str):
+        payload = json.dumps(payload, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def compact_tool_payloads(message: dict) -> dict:
+    """
+    Returns the API form of an assistant message with bulky tool payloads replaced by short stubs.
+
+    Search results keep only their document IDs and titles, Cortex Analyst results only their SQL,
+    and chart specs are replaced by a hash. Everything else is shared with the given message.
+
+    Args:
+        message (dict): The API form of a message.
+
+    Returns:
+        dict: The compacted message.
+    """
+    if message['role'] != 'assistant':
+        return message
+    content = []
+    for item in message['content']:
+        if item.get('type') == 'tool_results':
+            results = item['tool_results']
+            item = {**item, 'tool_results': {**results, 'content': [_compact_tool_result(result) for result in results.get('content', [])]}}
+        elif item.get('type') == 'chart':
+            item = {**item, 'chart': {**item['chart'], 'chart_spec': json.dumps({'sha256': _payload_hash(item['chart'].get('chart_spec', ''))})}}
+        content.append(item)
+    return {**message, 'content': content}
+
+def _is_turn_start(message: dict) -> bool:
+    # a turn starts with a prompt of the user, tool results belong to the turn that requested them
+    return message['role'] == 'user' and any(item.get('type') == 'text' for item in message['content'])
+
 class AgentMessageHistory:
     """
     Maintains a history of messages exchanged with the Cortex Agent.
 
-    This history is used to reconstruct the conversation context for subsequent API calls,
-    and it supports formatting of messages by removing non-serializable elements (like DataFrames).
+    This history is used to reconstruct the conversation context for subsequent API calls.
+    When a message is added, an API-ready form without non-serializable elements (like DataFrames),
+    its JSON encoding and an estimate of its tokens are stored alongside it, so building a request
+    only concatenates the already encoded messages instead of copying the whole history on every turn.
+
+    The history also manages the context window: compact() replaces bulky tool payloads of older
+    turns with short stubs, trim_to_budget() moves the start of the context past the oldest turns,
+    and set_summary() replaces them with a summary. Whole turns are dropped, so tool uses and their
+    results always stay together. All messages remain unchanged in the history.
     """
     def __init__(self):
         self.messages: List[Message] = []
+        self._api_messages: List[dict] = []
+        self._api_messages_json: List[str] = []
+        # running token totals, _token_totals[i] covers the messages before index i
+        self._token_totals: List[int] = [0]
+        self._turn_starts: List[int] = []
+        self._compacted_until = 0
+        self.context_start = 0
+        self.summary: Optional[str] = None
+        self._summary_messages: List[dict] = []
+        self._summary_messages_json: List[str] = []
+        self._summary_tokens = 0
 
     def add(self, message):
-        self.messages.append(message.to_dict())
+        message = message.to_dict()
+        if self.messages and self.messages[-1]['role'] == message['role']:
+            logger.warning(f"Two consecutive {message['role']} messages in the message history, the next request will be rejected.")
+        api_message = _to_api_message(message)
+        api_message_json = json.dumps(api_message, separators=(',', ':'))
+        if _is_turn_start(message):
+            self._turn_starts.append(len(self.messages))
+        self.messages.append(message)
+        self._api_messages.append(api_message)
+        self._api_messages_json.append(api_message_json)
+        self._token_totals.append(self._token_totals[-1] + estimate_tokens(api_message_json))
 
     def __iter__(self):
         return iter(self.messages)
     
     def __getitem__(self, index):
         return self.messages[index]
+
+    def __len__(self):
+        return len(self.messages)
     
     def __str__(self):
         if not self.messages:
@@ -184,16 +422,92 @@ class AgentMessageHistory:
         if not self.messages:
             return "[]"
         return "[\n  " + ",\n  ".join(repr(message) for message in self.messages) + "\n]"
+
+    @property
+    def context_tokens(self) -> int:
+        """Estimated number of tokens of the messages sent with the next request, including the summary."""
+        return self._summary_tokens + self._token_totals[-1] - self._token_totals[self.context_start]
+
+    def compact(self, keep_turns: int):
+        """
+        Replaces bulky tool payloads with short stubs in all but the most recent turns.
+
+        Args:
+            keep_turns (int): Number of most recent turns that are sent unchanged.
+        """
+        if keep_turns >= len(self._turn_starts):
+            return
+        boundary = self._turn_starts[-keep_turns] if keep_turns > 0 else len(self.messages)
+        if boundary <= self._compacted_until:
+            return
+        for index in range(self._compacted_until, boundary):
+            api_message = compact_tool_payloads(self._api_messages[index])
+            if api_message is not self._api_messages[index]:
+                self._api_messages[index] = api_message
+                self._api_messages_json[index] = json.dumps(api_message, separators=(',', ':'))
+        # recompute the running token totals from the first compacted message on
+        for index in range(self._compacted_until, len(self.messages)):
+            self._token_totals[index + 1] = self._token_totals[index] + estimate_tokens(self._api_messages_json[index])
+        self._compacted_until = boundary
+
+    def trim_to_budget(self, token_budget: int) -> List[dict]:
+        """
+        Moves the start of the context past the oldest turns until it fits into the token budget.
+
+        The most recent turn is always kept, even if it exceeds the budget on its own.
+
+        Args:
+            token_budget (int): Maximum number of estimated tokens to send.
+
+        Returns:
+            List[dict]: The messages that were removed from the context.
+        """
+        previous_start = self.context_start
+        for turn_start in self._turn_starts:
+            if turn_start <= self.context_start:
+                continue
+            if self.context_tokens <= token_budget:
+                break
+            self.context_start = turn_start
+        if self.context_start != previous_start:
+            logger.info(f"Removed {self.context_start - previous_start} messages from the context, {self.context_tokens} tokens remain.")
+        return self.messages[previous_start:self.context_start]
+
+    def set_summary(self, summary: Optional[str]):
+        """
+        Sets the summary that replaces the turns removed from the context.
+
+        Args:
+            summary (Optional[str]): Summary of the earlier conversation, None removes the summary.
+        """
+        self.summary = summary
+        self._summary_messages = []
+        if summary:
+            self._summary_messages = [
+                {'role': 'user', 'content': [{'type': 'text', 'text': f'Summary of the earlier conversation:\n{summary}'}]},
+                {'role': 'assistant', 'content': [{'type': 'text', 'text': 'Understood, I will take this summary into account.'}]},
+            ]
+        self._summary_messages_json = [json.dumps(message, separators=(',', ':')) for message in self._summary_messages]
+        self._summary_tokens = sum(estimate_tokens(message) for message in self._summary_messages_json)
     
     def format_for_agent_call(self):
-        # remove dataframes before calling API
-        messages = copy.deepcopy(self.messages)
-        for message in messages:
-            if message['role'] == 'user':
-                if message['content'][0].get('tool_results'):
-                    if 'query_df' in message['content'][0]['tool_results']['content'][0]['json']:
-                        del message['content'][0]['tool_results']['content'][0]['json']['query_df']
-        return messages
+        # messages without dataframes, shared with the history; treat them as read-only
+        return self._summary_messages + self._api_messages[self.context_start:]
+
+    def encode_request_body(self, body: dict) -> bytes:
+        """
+        Encodes a request body with the messages of this history as JSON.
+
+        Args:
+            body (dict): The request body; a 'messages' entry is replaced by the history's messages.
+
+        Returns:
+            bytes: The encoded request body.
+        """
+        fields = json.dumps({key: value for key, value in body.items() if key != 'messages'}, separators=(',', ':'))
+        messages = '"messages":[' + ','.join(self._summary_messages_json + self._api_messages_json[self.context_start:]) + ']'
+        separator = ',' if fields != '{}' else ''
+        return (fields[:-1] + separator + messages + '}').encode()
     
     def format_for_llm_call(self):
         # complete endpoint expects different structure
@@ -202,34 +516,242 @@ class AgentMessageHistory:
             formatted_messages.append({'role':message['role'], 'content':message['content'][0]['text']})
         return formatted_messages
     
-def format_events_for_message_history(events):
-    messages = []
-    text_response = ''
-    for event in events:
+@dataclass
+class AgentRunResult:
+    """
+    Represents the outcome of a single prompt processed in a batch.
+
+    Attributes:
+        index (int): Position of the prompt in the submitted batch.
+        prompt (str): The prompt that was sent to the agent.
+        text (str): The final text response of the agent.
+        message_history (AgentMessageHistory): Messages exchanged while answering the prompt.
+        api_history (AgentAPIHistory): API requests and responses made while answering the prompt.
+        error (Optional[Exception]): The exception raised while answering the prompt, if any.
+    """
+    index: int
+    prompt: str
+    text: str
+    message_history: AgentMessageHistory
+    api_history: AgentAPIHistory
+    error: Optional[Exception] = None
+
+@dataclass
+class TurnStep:
+    """
+    Represents one step of a turn: an agent call and the client-side SQL executions it requested.
+
+    Attributes:
+        index (int): Position of the step in the turn, starting at 0.
+        agent_seconds (float): Time in seconds from building the request until the response stream ended.
+        sql_seconds (float): Time in seconds spent waiting for the requested SQL executions.
+        sql_executions (int): Number of SQL statements executed after the agent call.
+    """
+    index: int
+    agent_seconds: float = 0.0
+    sql_seconds: float = 0.0
+    sql_executions: int = 0
+
+@dataclass(frozen=True, slots=True)
+class TextDelta:
+    """
+    A chunk of the agent's text response.
+
+    Attributes:
+        text (str): The text of the chunk.
+    """
+    text: str
+
+@dataclass(frozen=True, slots=True)
+class ToolUse:
+    """
+    A tool invocation requested by the agent.
+
+    Attributes:
+        tool_use_id (str): Identifier that links the tool use to its results.
+        name (str): Name of the tool.
+        input (dict): Input parameters for the tool, e.g. the query of a sql_exec tool.
+    """
+    tool_use_id: str
+    name: str
+    input: dict
+
+@dataclass(frozen=True, slots=True)
+class ToolResult:
+    """
+    Results of a server-side tool, e.g. the SQL generated by Cortex Analyst.
+
+    Attributes:
+        tool_use_id (str): Identifier of the corresponding tool use.
+        name (str): Name of the tool.
+        status (Optional[str]): Status reported by the tool.
+        content (list): Result content items as returned by the API.
+    """
+    tool_use_id: str
+    name: str
+    status: Optional[str]
+    content: list
+
+@dataclass(frozen=True, slots=True)
+class SearchResults:
+    """
+    Documents returned by a Cortex Search tool.
+
+    Attributes:
+        tool_use_id (str): Identifier of the corresponding tool use.
+        name (str): Name of the tool.
+        results (list): The search results, each with doc_id, doc_title, text and source_id.
+    """
+    tool_use_id: str
+    name: str
+    results: list
+
+@dataclass(frozen=True, slots=True)
+class ChartSpec:
+    """
+    A vega-lite chart generated by the agent.
+
+    Attributes:
+        chart_spec (str): The vega-lite chart specification as JSON string.
+    """
+    chart_spec: str
+
+    def to_dict(self) -> dict:
+        return json.loads(self.chart_spec)
+
+@dataclass(frozen=True, slots=True)
+class Done:
+    """
+    Marks the end of an agent response stream.
+    """
+
+@dataclass(frozen=True, slots=True)
+class QueryResultBatch:
+    """
+    A batch of the result of a client-side SQL execution, available before the whole result is downloaded.
+
+    Attributes:
+        query_id (str): The Snowflake query ID.
+        tool_use_id (str): Identifier of the sql_exec tool use that requested the query.
+        batch_index (int): Position of the batch in the result, starting at 0.
+        rows (pd.DataFrame): The rows of the batch.
+    """
+    query_id: str
+    tool_use_id: str
+    batch_index: int
+    rows: pd.DataFrame
+
+AgentStreamEvent = Union[TextDelta, ToolUse, ToolResult, SearchResults, ChartSpec, Done, QueryResultBatch]
+
+_DONE = Done()
+
+def to_typed_events(event: ServerSentEvent) -> Tuple[AgentStreamEvent, ...]:
+    """
+    Converts a Server-Sent Event of the agent stream into typed events.
+
+    Args:
+        event (ServerSentEvent): An event of the agent response stream.
+
+    Returns:
+        Tuple[AgentStreamEvent, ...]: One typed event per content item, empty for events without content.
+    """
+    if event.event == 'done':
+        return (_DONE,)
+    if event.event != 'message.delta':
+        return ()
+    delta = event.json().get('delta') or {}
+    typed_events = []
+    for content in delta.get('content') or ():
+        content_type = content.get('type')
+        if content_type == 'text':
+            typed_events.append(TextDelta(text=content['text']))
+        elif content_type == 'tool_use':
+            tool_use = content['tool_use']
+            typed_events.append(ToolUse(tool_use_id=tool_use.get('tool_use_id'), name=tool_use.get('name'), input=tool_use.get('input', {})))
+        elif content_type == 'tool_results':
+            tool_results = content['tool_results']
+            search_results = [
+                result['json']['searchResults'] for result in tool_results.get('content', [])
+                if result.get('type') == 'json' and result['json'].get('searchResults') is not None
+            ]
+            if search_results:
+                typed_events.append(SearchResults(
+                    tool_use_id=tool_results.get('tool_use_id'),
+                    name=tool_results.get('name'),
+                    results=[doc for results in search_results for doc in results]
+                ))
+            else:
+                typed_events.append(ToolResult(
+                    tool_use_id=tool_results.get('tool_use_id'),
+                    name=tool_results.get('name'),
+                    status=tool_results.get('status'),
+                    content=tool_results.get('content', [])
+                ))
+        elif content_type == 'chart':
+            typed_events.append(ChartSpec(chart_spec=content['chart']['chart_spec']))
+    return tuple(typed_events)
+
+class AssistantMessageBuilder:
+    """
+    Builds the content of an assistant message from the events of an agent response stream.
+
+    Every event is folded into the message as it arrives, so the raw events do not need to be
+    kept. Text deltas are collected as chunks and joined once when the message is built.
+    """
+    def __init__(self):
+        self._content: List[dict] = []
+        self._text_chunks: List[str] = []
+
+    def add(self, event: ServerSentEvent) -> List[dict]:
+        """
+        Adds an event of the response stream.
+
+        Returns:
+            List[dict]: The non-text content items of the event, e.g. complete tool uses.
+        """
         if event.event == 'message.delta':
-            data = json.loads(event.data)
-            content = data.get('delta')
-            content = content['content']
-            if content:
-                if content[0]['type'] == 'text':
-                    text_response += content[0]['text']
+            # a delta can mix text and other items, e.g. a text chunk followed by a tool use
+            content = []
+            for item in event.json().get('delta')['content'] or ():
+                if item.get('type') == 'text':
+                    self._text_chunks.append(item['text'])
                 else:
-                    messages.extend(content)
-        if event.event == 'done':
-            pass
-    if text_response != '':
-        messages.append({'type':'text', 'text':text_response})
-    return messages
+                    content.append(item)
+            self._content.extend(content)
+            return content
+        return []
+
+    def build(self) -> List[dict]:
+        """
+        Returns the content of the assistant message, with the text response last.
+        """
+        content = list(self._content)
+        text_response = ''.join(self._text_chunks)
+        if text_response != '':
+            content.append({'type':'text', 'text':text_response})
+        return content
+
+class LLMMessageBuilder(AssistantMessageBuilder):
+    """
+    Builds the content of an assistant message from the events of a complete response stream.
+    """
+    def add(self, event: ServerSentEvent):
+        """
+        Adds an event of the response stream.
+        """
+        if event.event == 'message':
+            delta = event.json()['choices'][0]['delta']
+            if 'content' in delta:
+                self._text_chunks.append(delta['content'])
+
+def format_events_for_message_history(events):
+    builder = AssistantMessageBuilder()
+    for event in events:
+        builder.add(event)
+    return builder.build()
 
 def format_events_for_llm_message_history(events):
-    messages = []
-    text_response = ''
+    builder = LLMMessageBuilder()
     for event in events:
-        if event.event == 'message':
-            data = json.loads(event.data)
-            if 'content' in data['choices'][0]['delta']:
-                content = data['choices'][0]['delta']['content']
-                text_response += content
-    if text_response != '':
-        messages.append({'type':'text', 'text':text_response})
-    return messages
\ No newline at end of file
+        builder.add(event)
+    return builder.build()
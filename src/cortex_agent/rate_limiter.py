@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+from typing import Dict, Tuple
+import asyncio
+import threading
+import time
+import logging
+
+logger = logging.getLogger("cortex_agent.rate_limiter")
+
+@dataclass(frozen=True)
+class RateLimit:
+    """
+    Client-side rate limit for one Cortex REST API endpoint.
+
+    Attributes:
+        requests_per_second (float): Sustained number of requests allowed per second.
+        burst (int): Number of requests that may be sent at once after an idle period.
+    """
+    requests_per_second: float
+    burst: int = 1
+
+    def __post_init__(self):
+        if self.requests_per_second <= 0:
+            raise ValueError("requests_per_second must be greater than 0.")
+        if self.burst < 1:
+            raise ValueError("burst must be at least 1.")
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all event loops and threads of the process.
+
+    Every caller reserves a token immediately and then sleeps until its reservation
+    becomes valid. Reservations are handed out in arrival order, so waiting callers
+    are served first-come, first-served.
+
+    Attributes:
+        rate_limit (RateLimit): The rate limit enforced by this bucket.
+    """
+    def __init__(self, rate_limit: RateLimit):
+        self.rate_limit = rate_limit
+        self._tokens = float(rate_limit.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._tokens = min(float(self.rate_limit.burst), self._tokens + elapsed * self.rate_limit.requests_per_second)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """
+        Takes a token from the bucket.
+
+        Returns:
+            float: Seconds the caller has to wait before sending its request.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate_limit.requests_per_second
+
+    def release(self):
+        """
+        Returns an unused token, e.g. if a waiting caller was cancelled.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(float(self.rate_limit.burst), self._tokens + 1)
+
+    async def acquire(self) -> float:
+        """
+        Waits until a request may be sent.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+        return delay
+
+_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+def get_token_bucket(account_url: str, endpoint: str, rate_limit: RateLimit) -> TokenBucket:
+    """
+    Returns the process-wide token bucket for an account and endpoint.
+
+    The bucket is created with the given rate limit on first use. Later calls for the
+    same account and endpoint share that bucket, regardless of the rate limit passed.
+    """
+    key = (account_url, endpoint)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(rate_limit)
+        elif bucket.rate_limit != rate_limit:
+            logger.warning(f"Rate limit for {endpoint} on {account_url} is already set to {bucket.rate_limit}. Ignoring {rate_limit}.")
+    return bucket
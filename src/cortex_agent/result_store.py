@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+import threading
+import logging
+import pandas as pd
+from snowflake.snowpark import Session
+from .sql_execution import SQLExecutionPolicy, compact_dtypes
+
+logger = logging.getLogger("cortex_agent.result_store")
+
+RESULT_STORE_MAX_BYTES = 256 * 1024 * 1024
+
+class ResultStore:
+    """
+    Thread-safe in-memory store for the results of client-side SQL executions, keyed by query ID.
+
+    Results are kept in least-recently-used order within a memory budget. When a new result
+    exceeds the budget, the least recently used results are evicted; the newest result is always
+    kept. Evicted results are fetched again with RESULT_SCAN when they are requested, with the
+    row cap and dtype compaction of the SQL execution policy, so they match the original result.
+
+    Args:
+        max_bytes (int): Memory budget for all stored DataFrames.
+        get_session (Optional[Callable[[], Session]]): Returns the session used to re-fetch evicted results.
+        policy (Optional[SQLExecutionPolicy]): Row cap and dtype compaction applied to re-fetched results.
+    """
+    def __init__(self, max_bytes: int = RESULT_STORE_MAX_BYTES, get_session: Optional[Callable[[], Session]] = None, policy: Optional[SQLExecutionPolicy] = None):
+        if max_bytes < 0:
+            raise ValueError("max_bytes must not be negative.")
+        self.max_bytes = max_bytes
+        self.get_session = get_session
+        self.policy = policy if policy is not None else SQLExecutionPolicy()
+        self._results: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Memory used by the stored DataFrames in bytes."""
+        return self._size
+
+    def put(self, query_id: str, query_df: pd.DataFrame) -> 'QueryResultHandle':
+        """
+        Stores the result of a query.
+
+        Args:
+            query_id (str): The Snowflake query ID.
+            query_df (pd.DataFrame): The query result.
+
+        Returns:
+            QueryResultHandle: A lightweight reference to the result.
+        """
+        nbytes = int(query_df.memory_usage(deep=True).sum())
+        with self._lock:
+            if query_id in self._results:
+                self._size -= self._results.pop(query_id)[1]
+            self._results[query_id] = (query_df, nbytes)
+            self._size += nbytes
+            self._evict()
+        return QueryResultHandle(query_id=query_id, store=self)
+
+    def get(self, query_id: str) -> pd.DataFrame:
+        """
+        Returns the result of a query, re-fetching it with RESULT_SCAN if it was evicted.
+
+        Args:
+            query_id (str): The Snowflake query ID.
+
+        Returns:
+            pd.DataFrame: The query result.
+        """
+        with self._lock:
+            if query_id in self._results:
+                self._results.move_to_end(query_id)
+                return self._results[query_id][0]
+        query_df = self._fetch(query_id)
+        self.put(query_id, query_df)
+        return query_df
+
+    def _fetch(self, query_id: str) -> pd.DataFrame:
+        session = self.get_session() if self.get_session is not None else None
+        if session is None:
+            raise KeyError(f"Result of query {query_id} was evicted and no session is available to fetch it again.")
+        logger.info(f"Fetching evicted result of query {query_id} with RESULT_SCAN.")
+        sql_statement = f"SELECT * FROM TABLE(RESULT_SCAN('{query_id}'))"
+        if self.policy.max_rows is not None:
+            sql_statement += f" LIMIT {self.policy.max_rows}"
+        query_df = session.sql(sql_statement).to_pandas()
+        if self.policy.compact_dtypes:
+            query_df = compact_dtypes(query_df, downcast_numerics=self.policy.downcast_numerics)
+        return query_df
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._results) > 1:
+            query_id, (_, nbytes) = self._results.popitem(last=False)
+            self._size -= nbytes
+            logger.debug(f"Evicted result of query {query_id} ({nbytes} bytes) from the result store.")
+
+    def clear(self):
+        """
+        Removes all stored results.
+        """
+        with self._lock:
+            self._results.clear()
+            self._size = 0
+
+    def __contains__(self, query_id: str) -> bool:
+        return query_id in self._results
+
+    def __len__(self):
+        return len(self._results)
+
+    def __repr__(self):
+        return f"ResultStore(max_bytes={self.max_bytes}, size={self._size}, results={len(self._results)})"
+
+class QueryResultHandle:
+    """
+    Lightweight reference to the result of a client-side SQL execution.
+
+    Messages hold a handle instead of the DataFrame itself. The DataFrame is looked up in the
+    result store when it is needed and re-fetched if it has been evicted.
+
+    Attributes:
+        query_id (str): The Snowflake query ID.
+        store (Optional[ResultStore]): The store holding the result.
+    """
+    __slots__ = ('query_id', 'store', '_query_df')
+
+    def __init__(self, query_id: str, store: Optional[ResultStore] = None, query_df: Optional[pd.DataFrame] = None):
+        self.query_id = query_id
+        self.store = store
+        # only used without a store
+        self._query_df = query_df
+
+    def to_pandas(self) -> pd.DataFrame:
+        """
+        Returns the query result as a pandas DataFrame.
+        """
+        if self.store is None:
+            return self._query_df
+        return self.store.get(self.query_id)
+
+    def __repr__(self):
+        return f"QueryResultHandle(query_id={self.query_id!r})"
@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import random
+import logging
+
+logger = logging.getLogger("cortex_agent.retry")
+
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+@dataclass
+class RetryPolicy:
+    """
+    Controls how failed calls to the Cortex REST APIs are retried.
+
+    A call is only retried before any event of its response has been passed on
+    to the caller. Delays grow exponentially, are capped and randomized with jitter.
+    If the server sends a Retry-After header, its value is used instead, capped at backoff_max.
+
+    Attributes:
+        max_retries (int): Maximum number of retries after the first attempt (0 disables retries).
+        backoff_base (float): Delay in seconds before the first retry.
+        backoff_max (float): Upper bound in seconds for a computed delay and for a Retry-After value.
+        jitter (float): Fraction of the delay that is randomized, between 0 (none) and 1 (full jitter).
+        retryable_status_codes (Tuple[int]): HTTP status codes that are considered transient.
+        respect_retry_after (bool): Whether to wait as long as the Retry-After header requests, up to backoff_max.
+    """
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    jitter: float = 1.0
+    retryable_status_codes: Tuple[int, ...] = RETRYABLE_STATUS_CODES
+    respect_retry_after: bool = True
+
+    def is_retryable(self, status_code: int) -> bool:
+        """
+        Returns True if a response with the given status code should be retried.
+        """
+        return status_code in self.retryable_status_codes
+
+    def get_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Computes the delay before the next attempt.
+
+        Args:
+            attempt (int): Number of the retry, starting at 0.
+            retry_after (Optional[str]): Value of the Retry-After response header, if any.
+
+        Returns:
+            float: Delay in seconds.
+        """
+        if self.respect_retry_after and retry_after is not None:
+            delay = parse_retry_after(retry_after)
+            if delay is not None:
+                if delay > self.backoff_max:
+                    logger.warning(f"Retry-After of {delay:.0f}s exceeds backoff_max, waiting {self.backoff_max}s instead.")
+                return min(self.backoff_max, delay)
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """
+    Parses a Retry-After header given either in seconds or as an HTTP date.
+
+    Returns:
+        Optional[float]: Delay in seconds or None if the value can not be parsed.
+    """
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logger.warning(f"Ignoring invalid Retry-After header: {value!r}")
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
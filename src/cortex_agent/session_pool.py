@@ -0,0 +1,257 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Deque, List, Optional, Tuple
+import asyncio
+import threading
+import time
+import logging
+from snowflake.snowpark import Session
+from .exceptions import CortexAgentSessionPoolTimeoutError
+
+logger = logging.getLogger("cortex_agent.session_pool")
+
+@dataclass
+class SessionPoolPolicy:
+    """
+    Size and health checks of a pool of Snowpark sessions for client-side SQL executions.
+
+    Attributes:
+        min_size (int): Number of sessions created up front and kept open.
+        max_size (int): Maximum number of sessions, idle and checked out.
+        health_check_interval (Optional[float]): Idle time in seconds after which a session is checked with SELECT 1 before it is handed out (None disables health checks).
+        checkout_timeout (Optional[float]): Maximum time in seconds to wait for a free session (None waits indefinitely).
+    """
+    min_size: int = 1
+    max_size: int = 4
+    health_check_interval: Optional[float] = 60.0
+    checkout_timeout: Optional[float] = 30.0
+
+    def __post_init__(self):
+        if self.min_size < 0 or self.max_size < 1 or self.min_size > self.max_size:
+            raise ValueError("min_size must not be negative and not greater than max_size, max_size must be at least 1.")
+
+class SessionPool:
+    """
+    Thread-safe pool of Snowpark sessions.
+
+    Sessions are created on demand up to max_size and reused after they are released. Sessions
+    that have been idle longer than the health check interval are checked before they are
+    handed out; broken sessions are closed and replaced.
+
+    Callers waiting for a free session queue up in FIFO order. release() hands the session
+    directly to the longest waiting caller, so waiting from async code does not occupy a
+    thread. Sessions are created and health-checked on a small dedicated executor, never on
+    the event loop's default executor.
+
+    Args:
+        create_session (Callable[[], Session]): Creates a new session, e.g. from the connection parameters of a connection.
+        policy (SessionPoolPolicy): Size, health check and checkout settings.
+    """
+    def __init__(self, create_session: Callable[[], Session], policy: Optional[SessionPoolPolicy] = None):
+        self.create_session = create_session
+        self.policy = policy if policy is not None else SessionPoolPolicy()
+        self._idle: List[Tuple[Session, float]] = []
+        # each waiter is resolved with an idle session and its idle time, or with None to create a session
+        self._waiters: Deque[Future] = deque()
+        self._size = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        # Session.builder is shared by all threads
+        self._create_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=min(self.policy.max_size, 4), thread_name_prefix='cortex-agent-session-pool')
+        for _ in range(self.policy.min_size):
+            self._idle.append((self._create(), time.monotonic()))
+            self._size += 1
+
+    @property
+    def size(self) -> int:
+        """Number of open sessions, idle and checked out."""
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        """Number of idle sessions."""
+        return len(self._idle)
+
+    def _create(self) -> Session:
+        with self._create_lock:
+            session = self.create_session()
+        logger.debug("Created a new session for the session pool.")
+        return session
+
+    def _is_healthy(self, session: Session) -> bool:
+        try:
+            session.sql('SELECT 1').collect()
+            return True
+        except Exception as e:
+            logger.warning(f"Closing broken pooled session: {e}")
+            return False
+
+    def _checkout(self):
+        # returns an idle session and its idle time, None to create a session, or a Future to wait for
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The session pool is closed.")
+            if self._idle:
+                return self._idle.pop()
+            if self._size < self.policy.max_size:
+                self._size += 1
+                return None
+            waiter = Future()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _hand_back(self, waiter: Future):
+        # a waiter that timed out or was cancelled after it had been resolved
+        if waiter.cancelled() or waiter.exception() is not None:
+            return
+        entry = waiter.result()
+        if entry is None:
+            self._discard()
+        else:
+            self.release(entry[0])
+
+    def _timeout_error(self, timeout: Optional[float]) -> CortexAgentSessionPoolTimeoutError:
+        return CortexAgentSessionPoolTimeoutError(f"No pooled session became available within {timeout}s ({self.policy.max_size} sessions checked out).", timeout)
+
+    def acquire(self, timeout: Optional[float] = None) -> Session:
+        """
+        Checks out a session, waiting for one to be released if the pool is exhausted.
+
+        Args:
+            timeout (Optional[float]): Maximum time to wait in seconds, defaults to the policy's checkout timeout.
+
+        Returns:
+            Session: The checked out session. Return it with release().
+
+        Raises:
+            CortexAgentSessionPoolTimeoutError: If no session became available within the timeout.
+        """
+        timeout = self.policy.checkout_timeout if timeout is None else timeout
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            entry = self._checkout()
+            if isinstance(entry, Future):
+                waiter = entry
+                try:
+                    entry = waiter.result(None if expires_at is None else max(expires_at - time.monotonic(), 0))
+                except TimeoutError:
+                    if not waiter.cancel():
+                        self._hand_back(waiter)
+                    raise self._timeout_error(timeout) from None
+            session = self._prepare(entry)
+            if session is not None:
+                return session
+
+    async def aacquire(self, timeout: Optional[float] = None) -> Session:
+        """
+        Checks out a session without blocking the event loop or a thread while waiting. See acquire().
+        """
+        timeout = self.policy.checkout_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        expires_at = None if timeout is None else loop.time() + timeout
+        while True:
+            entry = self._checkout()
+            if isinstance(entry, Future):
+                waiter = entry
+                try:
+                    async with asyncio.timeout_at(expires_at):
+                        entry = await asyncio.wrap_future(waiter)
+                except BaseException as e:
+                    # cancelling the wrapper cancels the waiter unless release() resolved it already
+                    if not waiter.cancel():
+                        self._hand_back(waiter)
+                    if isinstance(e, TimeoutError):
+                        raise self._timeout_error(timeout) from None
+                    raise
+            preparation = loop.run_in_executor(self._executor, self._prepare, entry)
+            try:
+                session = await asyncio.shield(preparation)
+            except asyncio.CancelledError:
+                # return the session once it is ready, nobody is waiting for it anymore
+                preparation.add_done_callback(lambda done: self.release(done.result()) if not done.cancelled() and done.exception() is None and done.result() is not None else None)
+                raise
+            if session is not None:
+                return session
+
+    def _prepare(self, entry: Optional[Tuple[Session, float]]) -> Optional[Session]:
+        # creates a session or checks an idle one, returns None if it was broken
+        if entry is None:
+            try:
+                return self._create()
+            except BaseException:
+                self._discard()
+                raise
+        session, idle_since = entry
+        interval = self.policy.health_check_interval
+        if interval is None or time.monotonic() - idle_since < interval or self._is_healthy(session):
+            return session
+        _close_session(session)
+        self._discard()
+        return None
+
+    def _next_waiter(self) -> Optional[Future]:
+        # must be called with the lock held
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if waiter.set_running_or_notify_cancel():
+                return waiter
+        return None
+
+    def release(self, session: Session, discard: bool = False):
+        """
+        Returns a checked out session to the pool.
+
+        Args:
+            session (Session): The session returned by acquire().
+            discard (bool): Whether to close the session instead of reusing it, e.g. after a connection error.
+        """
+        waiter = None
+        with self._lock:
+            keep = not discard and not self._closed
+            if keep:
+                waiter = self._next_waiter()
+                if waiter is None:
+                    self._idle.append((session, time.monotonic()))
+        if waiter is not None:
+            waiter.set_result((session, time.monotonic()))
+        elif not keep:
+            _close_session(session)
+            self._discard()
+
+    def _discard(self):
+        with self._lock:
+            waiter = None if self._closed else self._next_waiter()
+            if waiter is None:
+                self._size -= 1
+        if waiter is not None:
+            # the freed slot goes to the longest waiting caller, which creates a new session
+            waiter.set_result(None)
+
+    def close(self):
+        """
+        Closes all idle sessions. Checked out sessions are closed when they are released.
+        """
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            waiters = list(self._waiters)
+            self._waiters.clear()
+        for waiter in waiters:
+            if waiter.set_running_or_notify_cancel():
+                waiter.set_exception(RuntimeError("The session pool is closed."))
+        for session, _ in idle:
+            _close_session(session)
+        self._executor.shutdown(wait=False)
+
+    def __repr__(self):
+        return f"SessionPool(min_size={self.policy.min_size}, max_size={self.policy.max_size}, size={self._size}, idle={len(self._idle)}, waiting={len(self._waiters)})"
+
+def _close_session(session: Session):
+    try:
+        session.close()
+    except Exception as e:
+        logger.warning(f"Could not close pooled session: {e}")
@@ -0,0 +1,224 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+import hashlib
+import os
+import re
+import threading
+import time
+import logging
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger("cortex_agent.sql_cache")
+
+SQL_CACHE_TTL = 300.0
+SQL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# schema metadata key of the query ID in cached Arrow files
+_QUERY_ID_METADATA_KEY = b'cortex_agent.query_id'
+
+_CACHEABLE_STATEMENT = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+_NON_DETERMINISTIC = re.compile(
+    r'\b(CURRENT_TIMESTAMP|CURRENT_DATE|CURRENT_TIME|LOCALTIMESTAMP|LOCALTIME|SYSDATE|SYSTIMESTAMP|GETDATE|RANDOM|RANDSTR|UNIFORM|NORMAL|UUID_STRING|SEQ1|SEQ2|SEQ4|SEQ8|SAMPLE|TABLESAMPLE)\b',
+    re.IGNORECASE
+)
+# string literals, quoted identifiers, comments and whitespace
+_TOKENS = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|\s+)", re.DOTALL)
+
+def normalize_sql(sql_statement: str) -> str:
+    """
+    Normalizes a SQL statement for use as a cache key.
+
+    Whitespace outside of literals and quoted identifiers is collapsed, comments and trailing
+    semicolons are removed. Literals and identifiers keep their case.
+
+    Args:
+        sql_statement (str): The SQL statement.
+
+    Returns:
+        str: The normalized statement.
+    """
+    parts = []
+    for part in _TOKENS.split(sql_statement):
+        if not part:
+            continue
+        if part.isspace() or part.startswith('--') or part.startswith('/*'):
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+        else:
+            parts.append(part)
+    return ''.join(parts).strip().rstrip(';').strip()
+
+def is_cacheable(sql_statement: str) -> bool:
+    """
+    Returns True for queries whose results only depend on the data, i.e. no DML and no non-deterministic functions.
+    """
+    literals_removed = ' '.join(part for part in _TOKENS.split(sql_statement) if part and not part.startswith("'"))
+    return bool(_CACHEABLE_STATEMENT.match(literals_removed)) and not _NON_DETERMINISTIC.search(literals_removed)
+
+class SQLResultCache:
+    """
+    Thread-safe cache for the results of client-side SQL executions.
+
+    Entries are keyed by the normalized SQL text and the user, role, warehouse, database and
+    schema of the session, so results filtered by row access policies are never served to
+    another user, expire after a TTL and are evicted least-recently-used first when the byte
+    budget is exceeded. The cache lives in process memory or, if a directory is given, on the
+    local disk as Arrow IPC files, where it can be shared by several processes. A hit returns the DataFrame and
+    the query ID of the original execution.
+
+    Args:
+        ttl (float): Seconds after which an entry expires.
+        max_bytes (int): Byte budget for all entries (DataFrame memory, or file size on disk).
+        directory (Optional[str]): Directory for a disk cache, None keeps the cache in memory.
+    """
+    def __init__(self, ttl: float = SQL_CACHE_TTL, max_bytes: int = SQL_CACHE_MAX_BYTES, directory: Optional[str] = None):
+        if ttl <= 0:
+            raise ValueError("ttl must be greater than 0.")
+        if max_bytes < 0:
+            raise ValueError("max_bytes must not be negative.")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(sql_statement: str, context: Tuple[Optional[str], ...]) -> str:
+        """
+        Builds the cache key of a statement executed in a session context.
+
+        Args:
+            sql_statement (str): The SQL statement.
+            context (Tuple[Optional[str], ...]): User, role, warehouse, database and schema of the session.
+
+        Returns:
+            str: The cache key.
+        """
+        key = '\x1f'.join([normalize_sql(sql_statement), *[str(value) for value in context]])
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, pd.DataFrame]]:
+        """
+        Looks up a cached result.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Optional[Tuple[str, pd.DataFrame]]: The original query ID and the result, or None.
+        """
+        if self.directory is not None:
+            return self._get_from_disk(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            query_id, query_df, nbytes, created_at = entry
+            if time.time() - created_at > self.ttl:
+                del self._entries[key]
+                self._size -= nbytes
+                return None
+            self._entries.move_to_end(key)
+            return query_id, query_df
+
+    def put(self, key: str, query_id: str, query_df: pd.DataFrame):
+        """
+        Caches a result. Results larger than the byte budget are not cached.
+
+        Args:
+            key (str): The cache key.
+            query_id (str): The query ID of the execution.
+            query_df (pd.DataFrame): The result.
+        """
+        if self.directory is not None:
+            return self._put_to_disk(key, query_id, query_df)
+        nbytes = int(query_df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[2]
+            self._entries[key] = (query_id, query_df, nbytes, time.time())
+            self._size += nbytes
+            while self._size > self.max_bytes:
+                _, entry = self._entries.popitem(last=False)
+                self._size -= entry[2]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.arrow')
+
+    def _get_from_disk(self, key: str) -> Optional[Tuple[str, pd.DataFrame]]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+            query_id = table.schema.metadata[_QUERY_ID_METADATA_KEY].decode()
+            query_df = table.to_pandas()
+            # the access time is used for least-recently-used eviction
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            return query_id, query_df
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read cached SQL result {path}: {e}")
+            return None
+
+    def _put_to_disk(self, key: str, query_id: str, query_df: pd.DataFrame):
+        path = self._path(key)
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            table = pa.Table.from_pandas(query_df)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), _QUERY_ID_METADATA_KEY: query_id.encode()})
+            with pa.OSFile(temporary_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            if os.path.getsize(temporary_path) > self.max_bytes:
+                os.remove(temporary_path)
+                return
+            os.replace(temporary_path, path)
+        except Exception as e:
+            logger.warning(f"Could not cache SQL result in {path}: {e}")
+            return
+        self._evict_from_disk()
+
+    def _evict_from_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.arrow'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, name))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, name in sorted(files):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def clear(self):
+        """
+        Removes all cached results.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.arrow'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+    def __repr__(self):
+        return f"SQLResultCache(ttl={self.ttl}, max_bytes={self.max_bytes}, directory={self.directory!r})"
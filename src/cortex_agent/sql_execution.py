@@ -0,0 +1,191 @@
+from dataclasses import dataclass
+from typing import AsyncGenerator, Optional, Tuple
+import asyncio
+import logging
+import pandas as pd
+from snowflake.snowpark import Session
+from snowflake.snowpark.async_job import AsyncJob
+from .exceptions import CortexAgentSQLTimeoutError
+
+logger = logging.getLogger("cortex_agent.sql_execution")
+
+@dataclass
+class SQLExecutionPolicy:
+    """
+    Controls how SQL statements requested by the agent are executed on the client side.
+
+    Statements are submitted asynchronously and their status is polled with a delay that grows
+    from poll_interval to poll_interval_max, so waiting costs neither a CPU core nor a thread
+    while other conversations keep streaming.
+
+    Attributes:
+        timeout (Optional[float]): Maximum time in seconds a statement may run before it is cancelled (None for no limit).
+        poll_interval (float): Delay in seconds before the first status check.
+        poll_interval_max (float): Upper bound in seconds for the delay between status checks.
+        poll_backoff (float): Factor by which the delay grows after every status check.
+        max_rows (Optional[int]): Maximum number of result rows fetched per statement (None for all rows). Truncated results are logged as a warning.
+        compact_dtypes (bool): Whether to store repetitive text columns as categoricals.
+        downcast_numerics (bool): Whether compact_dtypes also downcasts integer columns to the smallest fitting type and float columns to float32. Off by default, since arithmetic on downcast columns can overflow or lose precision.
+        start_during_stream (bool): Whether to submit a statement as soon as its tool use arrives instead of after the response stream has ended.
+    """
+    timeout: Optional[float] = None
+    poll_interval: float = 0.05
+    poll_interval_max: float = 2.0
+    poll_backoff: float = 1.5
+    max_rows: Optional[int] = 100000
+    compact_dtypes: bool = True
+    downcast_numerics: bool = False
+    start_during_stream: bool = False
+
+    def __post_init__(self):
+        if self.poll_interval <= 0 or self.poll_interval_max < self.poll_interval:
+            raise ValueError("poll_interval must be greater than 0 and not greater than poll_interval_max.")
+        if self.poll_backoff < 1:
+            raise ValueError("poll_backoff must be at least 1.")
+        if self.max_rows is not None and self.max_rows < 0:
+            raise ValueError("max_rows must not be negative.")
+
+async def asubmit_sql(session: Session, sql_statement: str) -> AsyncJob:
+    """
+    Submits a SQL statement without waiting for it to finish.
+
+    Args:
+        session (Session): The Snowpark session to execute the statement with.
+        sql_statement (str): The SQL statement.
+
+    Returns:
+        AsyncJob: The running query.
+    """
+    loop = asyncio.get_running_loop()
+    submission = asyncio.ensure_future(asyncio.to_thread(lambda: session.sql(sql_statement).collect(block=False)))
+    try:
+        return await asyncio.shield(submission)
+    except asyncio.CancelledError:
+        # the statement may still be submitted by the worker thread, cancel it once its query id is known
+        def cancel_submitted(done: asyncio.Future):
+            if not done.cancelled() and done.exception() is None:
+                logger.info(f"Cancelling SQL query {done.result().query_id}.")
+                loop.run_in_executor(None, cancel_query, session, done.result().query_id)
+        submission.add_done_callback(cancel_submitted)
+        raise
+
+async def aget_session_context(session: Session) -> Tuple[Optional[str], ...]:
+    """
+    Returns the current user, role, warehouse, database and schema of a session.
+    """
+    row = await asyncio.to_thread(lambda: session.sql("SELECT CURRENT_USER(), CURRENT_ROLE(), CURRENT_WAREHOUSE(), CURRENT_DATABASE(), CURRENT_SCHEMA()").collect()[0])
+    return tuple(row)
+
+async def await_query(session: Session, query: AsyncJob, policy: SQLExecutionPolicy):
+    """
+    Waits for a submitted query to finish, polling its status with backoff.
+
+    The query is cancelled with SYSTEM$CANCEL_QUERY if it exceeds the policy's timeout
+    or if the waiting task is cancelled.
+
+    Args:
+        session (Session): The Snowpark session the query was submitted with.
+        query (AsyncJob): The running query.
+        policy (SQLExecutionPolicy): Polling and timeout settings.
+
+    Raises:
+        CortexAgentSQLTimeoutError: If the query did not finish within the timeout.
+    """
+    loop = asyncio.get_running_loop()
+    expires_at = None if policy.timeout is None else loop.time() + policy.timeout
+    delay = policy.poll_interval
+    try:
+        while not await asyncio.to_thread(query.is_done):
+            if expires_at is not None and loop.time() >= expires_at:
+                logger.warning(f"SQL query {query.query_id} exceeded its timeout of {policy.timeout}s and is cancelled.")
+                await asyncio.to_thread(cancel_query, session, query.query_id)
+                raise CortexAgentSQLTimeoutError(f"SQL query {query.query_id} did not finish within {policy.timeout}s.", policy.timeout)
+            await asyncio.sleep(delay if expires_at is None else min(delay, max(expires_at - loop.time(), 0)))
+            delay = min(delay * policy.poll_backoff, policy.poll_interval_max)
+    except asyncio.CancelledError:
+        # nobody is waiting for the results anymore, stop spending warehouse credits
+        logger.info(f"Cancelling SQL query {query.query_id}.")
+        loop.run_in_executor(None, cancel_query, session, query.query_id)
+        raise
+
+def cancel_query(session: Session, query_id: str):
+    """
+    Cancels a running query with SYSTEM$CANCEL_QUERY. Errors are logged, not raised.
+    """
+    try:
+        session.sql(f"SELECT SYSTEM$CANCEL_QUERY('{query_id}')").collect()
+    except Exception as e:
+        logger.warning(f"Could not cancel SQL query {query_id}: {e}")
+
+async def aiter_result_batches(query: AsyncJob, policy: SQLExecutionPolicy) -> AsyncGenerator[pd.DataFrame, None]:
+    """
+    Fetches the result of a finished query through Arrow, one pandas DataFrame per result batch.
+
+    Batches are downloaded in a worker thread one at a time, so the first batch is available
+    before the rest of the result has been downloaded. Fetching stops at the policy's row cap.
+
+    Args:
+        query (AsyncJob): The finished query.
+        policy (SQLExecutionPolicy): The row cap.
+
+    Yields:
+        pd.DataFrame: The result batches.
+    """
+    try:
+        batches = await asyncio.to_thread(query.result, 'pandas_batches')
+    except Exception as e:
+        # e.g. statements without a result set that can not be fetched through Arrow
+        logger.debug(f"Could not fetch the result of SQL query {query.query_id} through Arrow, fetching rows instead: {e}")
+        batches = iter([pd.DataFrame(await asyncio.to_thread(query.result))])
+    remaining = policy.max_rows
+    while True:
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            return
+        if remaining is not None:
+            # a result of exactly max_rows rows is complete, only dropped rows are reported
+            if len(batch) > remaining:
+                logger.warning(f"Result of SQL query {query.query_id} was truncated to {policy.max_rows} rows, raise SQLExecutionPolicy.max_rows to fetch more.")
+                if remaining > 0:
+                    yield batch.iloc[:remaining]
+                return
+            remaining -= len(batch)
+        yield batch
+
+def compact_dtypes(query_df: pd.DataFrame, downcast_numerics: bool = False) -> pd.DataFrame:
+    """
+    Reduces the memory used by a query result.
+
+    Text columns with few distinct values are converted to categoricals. With downcast_numerics,
+    integer columns are also downcast to the smallest fitting type and float columns to float32
+    where the values are unchanged. The given DataFrame is not modified.
+
+    Args:
+        query_df (pd.DataFrame): The query result.
+        downcast_numerics (bool): Whether to downcast numeric columns as well.
+
+    Returns:
+        pd.DataFrame: A copy of the query result with compact dtypes.
+    """
+    # replacing columns of a shallow copy leaves the original columns untouched
+    query_df = query_df.copy(deep=False)
+    for column in query_df.columns:
+        series = query_df[column]
+        if pd.api.types.is_bool_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            if downcast_numerics:
+                query_df[column] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            if downcast_numerics:
+                downcast = series.astype('float32')
+                if ((downcast == series) | series.isna()).all():
+                    query_df[column] = downcast
+        elif (series.dtype == object or pd.api.types.is_string_dtype(series)) and len(series) > 0:
+            try:
+                if series.nunique(dropna=True) <= len(series) // 2:
+                    query_df[column] = series.astype('category')
+            except TypeError:
+                # unhashable values, e.g. VARIANT columns
+                pass
+    return query_df
@@ -0,0 +1,177 @@
+from typing import List, Optional, AsyncGenerator
+from httpx_sse._models import ServerSentEvent
+import httpx
+import json
+import logging
+
+logger = logging.getLogger("cortex_agent.sse")
+
+_NOT_DECODED = object()
+
+# size of the buffered start of an event above which its data is decoded in place
+_LARGE_EVENT_BYTES = 64 * 1024
+
+class ParsedServerSentEvent(ServerSentEvent):
+    """
+    A ServerSentEvent whose JSON payload is decoded at most once.
+
+    The decoded payload is cached on the event, so callbacks, the message history and the
+    tool detection all share the same dictionary instead of parsing event.data again.
+    Treat the returned dictionary as read-only.
+    """
+    def __init__(self, event: Optional[str] = None, data: Optional[str] = None, id: Optional[str] = None, retry: Optional[int] = None):
+        super().__init__(event=event, data=data, id=id, retry=retry)
+        self._json = _NOT_DECODED
+
+    @classmethod
+    def from_event(cls, event: ServerSentEvent) -> 'ParsedServerSentEvent':
+        """
+        Wraps an event produced by another decoder, e.g. httpx_sse.
+        """
+        if isinstance(event, cls):
+            return event
+        return cls(event=event.event, data=event.data, id=event.id, retry=event.retry)
+
+    def json(self):
+        if self._json is _NOT_DECODED:
+            self._json = json.loads(self.data)
+        return self._json
+
+class SSEByteDecoder:
+    """
+    Incremental decoder for the raw bytes of a text/event-stream response.
+
+    Incoming chunks are appended to a buffer until at least one complete event (terminated by a
+    blank line) is available. All complete events of a chunk are then decoded from UTF-8 in one
+    go and split into frames, instead of decoding and dispatching the stream line by line. An
+    event that spans many chunks, e.g. search results with full documents, is decoded straight
+    from the buffer so that its data is copied only once.
+    """
+    def __init__(self):
+        # pending bytes of an incomplete event
+        self._buffer = bytearray()
+        self._pending_cr = False
+        self._last_event_id = ''
+
+    def feed(self, chunk: bytes) -> List[ParsedServerSentEvent]:
+        """
+        Adds a chunk of bytes to the decoder.
+
+        Only the new chunk and the last byte before it are searched for an event terminator,
+        so a large event arriving in many chunks is decoded in linear time.
+
+        Args:
+            chunk (bytes): The next chunk of the response body.
+
+        Returns:
+            List[ParsedServerSentEvent]: All events completed by this chunk.
+        """
+        if self._pending_cr:
+            chunk = b'\r' + chunk
+            self._pending_cr = False
+        if b'\r' in chunk:
+            # a trailing CR may be the first half of a CRLF split across chunks
+            if chunk.endswith(b'\r'):
+                chunk = chunk[:-1]
+                self._pending_cr = True
+            chunk = chunk.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        if not chunk:
+            return []
+        buffer = self._buffer
+        # the terminator may be split across the previous and this chunk
+        scan_from = max(len(buffer) - 1, 0)
+        buffer += chunk
+        end = buffer.rfind(b'\n\n', scan_from)
+        if end == -1:
+            return []
+        events = []
+        start = 0
+        if scan_from >= _LARGE_EVENT_BYTES:
+            first_end = buffer.find(b'\n\n', scan_from)
+            events.extend(self._decode_large_frame(first_end))
+            start = first_end + 2
+        if start < end:
+            events.extend(self._decode_frames(buffer[start:end].decode('utf-8')))
+        del buffer[:end + 2]
+        return events
+
+    def _decode_large_frame(self, end: int) -> List[ParsedServerSentEvent]:
+        buffer = self._buffer
+        with memoryview(buffer) as view:
+            if buffer.startswith(b'event: '):
+                newline = buffer.find(b'\n', 0, end)
+                if newline != -1 and buffer.startswith(b'data: ', newline + 1) and buffer.find(b'\n', newline + 1, end) == -1:
+                    return [ParsedServerSentEvent(event=str(view[7:newline], 'utf-8'), data=str(view[newline + 7:end], 'utf-8'), id=self._last_event_id)]
+            return self._decode_frames(str(view[:end], 'utf-8'))
+
+    def _decode_frames(self, text: str) -> List[ParsedServerSentEvent]:
+        events = []
+        for frame in text.split('\n\n'):
+            # fast path for the common "event: <name>\ndata: <payload>" frame
+            if frame[:7] == 'event: ':
+                newline = frame.find('\n')
+                if newline != -1 and frame.startswith('data: ', newline + 1) and frame.find('\n', newline + 1) == -1:
+                    events.append(ParsedServerSentEvent(event=frame[7:newline], data=frame[newline + 7:], id=self._last_event_id))
+                    continue
+            event = None
+            data = []
+            retry = None
+            has_id = False
+            for line in frame.split('\n'):
+                if not line or line[0] == ':':
+                    continue
+                field, _, value = line.partition(':')
+                if value[:1] == ' ':
+                    value = value[1:]
+                if field == 'data':
+                    data.append(value)
+                elif field == 'event':
+                    event = value
+                elif field == 'id':
+                    if '\0' not in value:
+                        self._last_event_id = value
+                        has_id = True
+                elif field == 'retry':
+                    try:
+                        retry = int(value)
+                    except ValueError:
+                        pass
+            if event is None and not data and not has_id and retry is None:
+                continue
+            events.append(ParsedServerSentEvent(event=event, data='\n'.join(data), id=self._last_event_id, retry=retry))
+        return events
+
+    def flush(self) -> List[ParsedServerSentEvent]:
+        """
+        Completes decoding at the end of the stream.
+
+        Returns:
+            List[ParsedServerSentEvent]: An event that was only terminated by a trailing CR, if any.
+        """
+        if self._pending_cr:
+            return self.feed(b'\n')
+        return []
+
+    @property
+    def pending(self) -> bytes:
+        """Bytes of an incomplete event that have not been dispatched yet."""
+        return bytes(self._buffer) + (b'\r' if self._pending_cr else b'')
+
+async def aiter_sse_bytes(response: httpx.Response) -> AsyncGenerator[ParsedServerSentEvent, None]:
+    """
+    Yields the Server-Sent Events of a streamed response using SSEByteDecoder.
+
+    Args:
+        response (httpx.Response): A streamed response with content type text/event-stream.
+
+    Yields:
+        ParsedServerSentEvent: The decoded events.
+    """
+    decoder = SSEByteDecoder()
+    async for chunk in response.aiter_bytes():
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.flush():
+        yield event
+    if decoder.pending.strip():
+        logger.warning("Discarding incomplete event at the end of the stream.")